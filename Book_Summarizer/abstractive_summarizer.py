@@ -6,83 +6,176 @@ Create an abstractive summary from chapters of a large document.
 import re
 from os import makedirs
 from os.path import exists
-from spacy import load
 from regex import Regex, UNICODE, IGNORECASE
 from extractive_summarizer import find_relevant_quote
 from data import get_data_filename
+from nlp_models import load_nlp, parse_with_pipes, BLANK_MODEL
+from profiler import span
 from nats.pointer_generator_network.model import *
+from LeafNATS.data.utils import create_batch_file
 import argparse
+import os
+import shutil
+import time
+from threading import Lock, local
 
 CONTRACTIONS = (r'^\p{Alpha}+(\'(ll|ve|re|[dsm])|n\'t)$')
 CURRENCY_OR_INIT_PUNCT = (r'^[\p{Sc}\(\[\{\¿\¡]+$')
 NOPRESPACE_PUNCT = (r'^[\,\.\?\!\:\;\\\%\}\]\)]+$')
 FINAL_PUNCT = (r'([\.!?])([\'\"\)\]\p{Pf}\%])*$')
-
-
-def process_text_in(file_in, file_out):
+# the patterns are compiled once, detokenize_line is run for every summary line
+CONTRACTIONS_REGEX = Regex(CONTRACTIONS)
+CURRENCY_OR_INIT_PUNCT_REGEX = Regex(CURRENCY_OR_INIT_PUNCT)
+NOPRESPACE_PUNCT_REGEX = Regex(NOPRESPACE_PUNCT)
+FINAL_PUNCT_REGEX = Regex(FINAL_PUNCT)
+# the title and summary of the LeafNATS input segments are always the same words
+TITLE_SEGMENT = '<s> title </s>'
+SUMMARY_SEGMENT = '<s> summary </s>'
+# the sentences of plain text can be found by the senter component of the spaCy model,
+# the sentencizer of a blank spaCy pipeline, which does not need the model,
+# or by rules without spaCy
+SEGMENTERS = ['model', 'sentencizer', 'rules']
+SEGMENTER = 'model'
+# the senter component is much faster than the parser and does not need the other components
+SEGMENTER_PIPES = ['senter']
+# the rules end a sentence at final punctuation and any closing quotes followed by a space,
+# and split the lower case text into words, contractions and punctuation like spaCy
+SENTENCE_END_REGEX = re.compile(r'[.!?]+[\'")\]]*(?=\s|$)')
+TOKEN_REGEX = re.compile(r"[a-z0-9]+(?=n't)|n't|'(?:s|m|d|ll|ve|re)\b|[a-z0-9]+|[^\sa-z0-9]")
+# the number of tokens in a segment for the abstractive summarizer
+SEGMENT_TOKENS = 200
+# the version of the segments, part of the cache key of the abstractive summaries,
+# increase it when a change to the segmenters can change the segments
+SEGMENTS_VERSION = 2
+# the text features used by LeafNATS, longest first so the markers are removed whole
+SPECIAL_TOKENS_REGEX = Regex(r'<s> summary </s>|<s> title </s>|</?s>|<sec>|<stop>|<pad>')
+
+
+def process_text_in(file_in, file_out, segmenter=SEGMENTER):
     """
     Process text from plain text to the form expected by LeafNATS.
 
     Parameters:
     file_in: the filename of the plain text input file
     file_out: the filename of the file to be used by LeafNATS
+    segmenter: how the sentences are found, one of SEGMENTERS
 
     Returns:
     int: the number of segments the plain text has been broken up into
     book_text: the full plain text input loaded from the file
-    """    
-    book_text = ''
+    """
     with open(file_in, 'rb') as book:
-        # remove special characters and make lower case
-        for line in book:
-            line = line.decode('utf-8').encode('ascii',
-                                               'ignore').decode('ascii')
-            book_text = book_text + ' ' + line.lower()
-    if len(book_text) > 1000000:
-        book_text = book_text[:1000000]
-    nlp = load('en_core_web_lg', disable=['tagger', 'ner'])
-    summary = 'summary'
-    title = 'title'
-    if book_text == None or summary == None or title == None:
-        return ''
-    # break down article into 400 token chunks
-    with open(file_out, 'w') as processed_book:
-        summary = nlp(summary)
-        sen_arr = []
-        for sen in summary.sents:
-            sen = [k.text for k in sen if '\n' not in k.text]
-            sen = ['<s>']+sen+['</s>']
-            sen = ' '.join(sen)
-            sen_arr.append(sen)
-        summary = ' '.join(sen_arr)
-        title = nlp(title)
-        sen_arr = []
-        for sen in title.sents:
-            sen = [k.text for k in sen if '\n' not in k.text]
-            sen = ['<s>']+sen+['</s>']
-            sen = ' '.join(sen)
-            sen_arr.append(sen)
-        title = ' '.join(sen_arr)
-        whole_article = nlp(book_text)
-        sen_arr = []
-        curr_len = 0
-        num_segments = 0
-        for sen in whole_article.sents:
-            sen = [k.text for k in sen if '\n' not in k.text]
-            curr_len += len(sen)
-            if curr_len > 200:
-                article = ' '.join(sen_arr)
-                processed_book.write(title + summary + '<sec>' + article)
-                processed_book.write('\n')
-                sen_arr = []
-                curr_len = 0
-                num_segments += 1
-            sen = ' '.join(sen)
-            sen_arr.append(sen)
-        article = ' '.join(sen_arr)
-        processed_book.write(title + summary + '<sec>' + article)
-        processed_book.write('\n')
-    return num_segments, book_text
+        text = book.read().decode('utf-8')
+    # remove special characters and make lower case, with a space before each line
+    lines = fold_text(text).split('\n')
+    book_text = ''.join(' ' + line + '\n' for line in lines[:-1])
+    if len(lines[-1]) > 0:
+        book_text += ' ' + lines[-1]
+    segments = text_to_segments(book_text, segmenter)
+    save_lines(file_out, segments)
+    return len(segments) - 1, book_text
+
+
+def fold_text(text):
+    """ Remove the special characters from text and make it lower case. """
+    return text.encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def text_to_segments(text, segmenter=SEGMENTER):
+    """
+    Process plain text to the segments expected by LeafNATS.
+
+    Parameters:
+    text: the plain text
+    segmenter: how the sentences are found, one of SEGMENTERS
+
+    Returns:
+    list: the segments of about 200 tokens, in the LeafNATS input form
+    """
+    # remove special characters and make lower case
+    text = fold_text(text)
+    if len(text) > 1000000:
+        text = text[:1000000]
+    return sentences_to_segments(get_sentence_tokens(text, segmenter))
+
+
+def get_sentence_tokens(text, segmenter=SEGMENTER):
+    """
+    Split plain text into sentences of tokens.
+
+    Parameters:
+    text: the lower case plain text
+    segmenter: how the sentences are found, one of SEGMENTERS
+
+    Returns:
+    generator: the token texts of each sentence
+    """
+    if segmenter == 'rules':
+        start = 0
+        for match in SENTENCE_END_REGEX.finditer(text):
+            yield TOKEN_REGEX.findall(text, start, match.end())
+            start = match.end()
+        tokens = TOKEN_REGEX.findall(text, start)
+        if len(tokens) > 0:
+            yield tokens
+        return
+    if segmenter == 'sentencizer':
+        doc = load_nlp(BLANK_MODEL, fallback=None, enable=['sentencizer'])(text)
+    else:
+        # the senter of the shared model is run on its own, although it is disabled
+        doc = parse_with_pipes(load_nlp(), text, SEGMENTER_PIPES)
+    for sen in doc.sents:
+        yield [k.text for k in sen]
+
+
+def sentences_to_segments(sentences):
+    """
+    Process sentences of tokens to the segments expected by LeafNATS.
+
+    Parameters:
+    sentences: the token texts of each sentence
+
+    Returns:
+    list: the segments of about 200 tokens, in the LeafNATS input form
+    """
+    sentences = [clean_tokens(sen) for sen in sentences]
+    return [create_segment(sentences, group) for group in group_sentences(sentences)]
+
+
+def clean_tokens(tokens):
+    """ Make the tokens lower case with special characters and new lines removed. """
+    tokens = [fold_text(k) for k in tokens if '\n' not in k]
+    return [k for k in tokens if len(k) > 0]
+
+
+def group_sentences(sentences):
+    """
+    Group sentences into segments of about 200 tokens.
+
+    Parameters:
+    sentences: the cleaned tokens of each sentence
+
+    Returns:
+    list: the indexes of the sentences in each segment
+    """
+    groups = []
+    group = []
+    curr_len = 0
+    for index, sen in enumerate(sentences):
+        curr_len += len(sen)
+        if curr_len > SEGMENT_TOKENS:
+            groups.append(group)
+            group = []
+            curr_len = 0
+        group.append(index)
+    groups.append(group)
+    return groups
+
+
+def create_segment(sentences, group):
+    """ Create a segment in the LeafNATS input form from a group of sentences of tokens. """
+    article = ' '.join(' '.join(sentences[index]) for index in group)
+    return TITLE_SEGMENT + SUMMARY_SEGMENT + '<sec>' + article
 
 
 def process_text_out(filename_in, filename_out):
@@ -98,56 +191,83 @@ def process_text_out(filename_in, filename_out):
     list: a list of the lines of text output by LeafNATS
     """
     with open(filename_in, 'r') as file_in:
-        with open(filename_out, 'w') as file_out:
-            lines = []
-            for line in file_in:
-                line = line.rstrip('\r\n')
-                line = line.replace('<s> summary </s>', '')
-                line = line.replace('<s> title </s>', '')
-                line = line.replace('<s>', '')
-                line = line.replace('</s>', '')
-                line = line.replace('<sec>', '\n')
-                line = line.replace('<stop>', '')
-                line = line.replace('<pad>', '')
-                line = detokenize_line(line)
-                file_out.write(line)
-                lines.append(line)
+        lines = summaries_to_text(file_in)
+    with open(filename_out, 'w') as file_out:
+        for line in lines:
+            file_out.write(line)
+    return lines
+
+
+def summaries_to_text(summaries):
+    """
+    Process the output of LeafNATS to plain text.
+    This function removes the text features used by LeafNATS and makes this readable text.
+
+    Parameters:
+    summaries: the lines output by LeafNATS
+
+    Returns:
+    list: a list of the lines of readable text
+    """
+    lines = []
+    for line in summaries:
+        line = SPECIAL_TOKENS_REGEX.sub(replace_special_token, line.rstrip('\r\n'))
+        lines.append(detokenize_line(line))
     return lines
 
 
+def replace_special_token(match):
+    """ The replacement for a LeafNATS text feature, sections become new lines. """
+    if match.group() == '<sec>':
+        return '\n'
+    return ''
+
+
+def save_lines(filename, lines):
+    """ Saves lines to filename, one per line. """
+    with open(filename, 'w') as lines_file:
+        for line in lines:
+            lines_file.write(line.rstrip('\n') + '\n')
+
+
 def detokenize_line(line):
     """
     Detokenize the given text.
     adapted from:
     https://github.com/ufal/mtmonkey/blob/master/worker/src/util/detokenize.py
+    Only the text up to the end of the first sentence is kept, so the words after it
+    are not processed.
 
     Parameters:
     line: the line of text to detokenize
 
     Returns:
     str: the detokenized text
-    """    
+    """
     # split text
     words = line.split(' ')
     # paste text back, omitting spaces where needed
-    text = ''
+    text = []
+    text_len = 0
+    last_char = ''
     pre_spc = ' '
     quote_count = {'\'': 0, '"': 0, '`': 0}
     capitalize_next = True
     text_len_last_final_punct = 0
+    end_len = 0
     for pos, word in enumerate(words):
         # no space after currency and initial punctuation
-        if Regex(CURRENCY_OR_INIT_PUNCT).match(word):
-            text += pre_spc + word
+        if CURRENCY_OR_INIT_PUNCT_REGEX.match(word):
+            piece = pre_spc + word
             pre_spc = ''
         # no space before commas etc. (exclude some punctuation for French)
-        elif Regex(NOPRESPACE_PUNCT).match(word):
-            text += word
+        elif NOPRESPACE_PUNCT_REGEX.match(word):
+            piece = word
             pre_spc = ' '
         # contractions with comma or hyphen
         elif word in "'-–" and pos > 0 and pos < len(words) - 1 \
-                and Regex(CONTRACTIONS).match(''.join(words[pos - 1:pos + 2])):
-            text += word
+                and CONTRACTIONS_REGEX.match(''.join(words[pos - 1:pos + 2])):
+            piece = word
             pre_spc = ''
         # handle quoting
         elif word in '\'"„“”‚‘’`':
@@ -159,27 +279,27 @@ def detokenize_line(line):
             elif quote_type in '‚‘’':
                 quote_type = '\''
             # special case: possessives in English ("Jones'" etc.)
-            if text.endswith('s'):
-                text += word
+            if last_char == 's':
+                piece = word
                 pre_spc = ' '
             # really a quotation mark
             else:
                 # opening quote
                 if quote_count[quote_type] % 2 == 0:
-                    text += pre_spc + word
+                    piece = pre_spc + word
                     pre_spc = ''
                 # closing quote
                 else:
-                    text += word
+                    piece = word
                     pre_spc = ' '
                 quote_count[quote_type] += 1
         # contractions where comma or hyphen is already joined to following letters
         elif word[0] in "'-–" and pos > 0 and pos < len(words) - 1 \
-                and Regex(CONTRACTIONS).match(''.join(words[pos - 1:pos + 1])):
-            text += word
+                and CONTRACTIONS_REGEX.match(''.join(words[pos - 1:pos + 1])):
+            piece = word
             pre_spc = ' '
         elif word == "n't":
-            text += word
+            piece = word
             pre_spc = ' '
         # keep spaces around normal words
         else:
@@ -191,78 +311,305 @@ def detokenize_line(line):
                     word = word[0].upper() + word[1:]
             if word == 'i':
                 word = word.upper()
-            text += pre_spc + word
+            piece = pre_spc + word
             pre_spc = ' '
-        if Regex(FINAL_PUNCT).match(word) and (text_len_last_final_punct == 0):
+        text.append(piece)
+        text_len += len(piece)
+        if len(piece) > 0:
+            last_char = piece[-1]
+        if (text_len_last_final_punct == 0) and FINAL_PUNCT_REGEX.match(word):
             capitalize_next = True
-            text_len_last_final_punct = len(text)
+            text_len_last_final_punct = text_len
+            # the text is cut at this length after the leading space is stripped
+            leading = ''.join(text)
+            end_len = text_len_last_final_punct + len(leading) - len(leading.lstrip())
+        # stop when the rest of the words cannot change the text that is kept
+        kept_len = len(piece.rstrip())
+        if (text_len_last_final_punct > 0) and (kept_len > 0) and \
+                (text_len - len(piece) + kept_len >= end_len):
+            break
     # strip leading/trailing space
-    text = text.strip()
+    text = ''.join(text).strip()
     text = text[:text_len_last_final_punct]
     return text
 
 
-def create_abstr_abstr_summary_chapter(book_id, chapter, small=True):
+def summarize_segments(segments, debug_dir=None, debug_name='summary', batch_size=None):
     """
-    Create an abstractive summary from an abstractive summary.
+    Create the abstractive summary of segments of text, in memory.
+
+    Parameters:
+    segments: the segments in the LeafNATS input form
+    debug_dir: if given, the directory to save the segments, LeafNATS output and text in
+    debug_name: the start of the filenames used in debug_dir
+    batch_size: the maximum number of segments in a beam search batch
+
+    Returns:
+    list: the lines of readable text of the abstractive summary
+    """
+    return summarize_chapter_segments([segments], debug_dir, [debug_name], batch_size)[0]
+
+
+def summarize_chapter_segments(chapter_segments, debug_dir=None, debug_names=None,
+                               batch_size=None):
+    """
+    Create the abstractive summaries of the segments of several chapters.
+    The segments of all the chapters are summarized together, so that the beam search
+    runs on full batches.
+
+    Parameters:
+    chapter_segments: for each chapter, the segments in the LeafNATS input form
+    debug_dir: if given, the directory to save the segments, LeafNATS output and text in
+    debug_names: for each chapter, the start of the filenames used in debug_dir
+    batch_size: the maximum number of segments in a beam search batch
+
+    Returns:
+    list: for each chapter, the lines of readable text of the abstractive summary
+    """
+    all_segments = [segment for segments in chapter_segments for segment in segments]
+    all_summaries = get_abstractive_summarizer().summarize(all_segments, batch_size)
+    chapter_lines = []
+    start = 0
+    for chapter, segments in enumerate(chapter_segments):
+        summaries = all_summaries[start:start + len(segments)]
+        start += len(segments)
+        lines = summaries_to_text(summaries)
+        if debug_dir is not None:
+            if not exists(debug_dir):
+                makedirs(debug_dir)
+            debug_name = debug_names[chapter]
+            save_lines(os.path.join(debug_dir, debug_name + '-in.txt'), segments)
+            save_lines(os.path.join(debug_dir, debug_name + '-out.txt'), summaries)
+            save_lines(os.path.join(debug_dir, debug_name + '-text.txt'), lines)
+        chapter_lines.append(lines)
+    return chapter_lines
+
+
+def create_abstr_abstr_segments(book_id, chapter, parsed_chapter=None, segmenter=SEGMENTER):
+    """
+    Create the segments of a chapter for the abstractive summary from an abstractive summary.
 
     Parameters:
     book_id: (str) the book identifier
     chapter: the chapter to summarize
+    parsed_chapter: the ChapterAnalysis of the chapter, so the chapter is not read again
+    segmenter: how the sentences are found, one of SEGMENTERS
+
+    Returns:
+    list: the segments of the chapter in the LeafNATS input form
+    """
+    if parsed_chapter is None:
+        with open(get_data_filename(book_id, 'book_chapters', chapter), 'r') as chapter_file:
+            return text_to_segments(' '.join(chapter_file), segmenter)
+    # the chapter is segmented on the folded text as the later levels are, rather than
+    # with the sentences of the parsed chapter
+    return text_to_segments(' '.join(parsed_chapter.lines), segmenter)
+
+
+def create_abstr_abstr_summaries(chapter_segments, small=True, debug_dir=None,
+                                 debug_names=None, batch_size=None, segmenter=SEGMENTER,
+                                 level_stats=None):
+    """
+    Create abstractive summaries from abstractive summaries for several chapters.
+    Each level of the summary is created for all the chapters together, so that
+    segments from different chapters share beam search batches.
+    A chapter stops as soon as its summary has few enough sentences. At each level
+    the sentences of the previous level are grouped into segments, a sentence is only
+    tokenized once, and a segment with only one sentence is already as short as a
+    summary sentence, so it is kept instead of being summarized again.
+
+    Parameters:
+    chapter_segments: for each chapter, the segments from create_abstr_abstr_segments
     small: how short to make the summary. small is 1 to 5 sentences, large is up to 20 sentences.
+    debug_dir: if given, the directory to save the input and output of each level in
+    debug_names: for each chapter, the start of the filenames used in debug_dir
+    batch_size: the maximum number of segments in a beam search batch
+    segmenter: how the sentences of each level are found, one of SEGMENTERS
+    level_stats: if given, a list that a dict is added to for each level, with the
+    number of chapters, the segments summarized and kept, and the time in seconds
 
     Returns:
-    list: the sentences of the abstractive summary
+    list: for each chapter, the sentences of the abstractive summary
     """
-    if not exists('../sum_data'):
-        makedirs('../sum_data')
-    num_segments, book_text = process_text_in(get_data_filename(
-        book_id, 'book_chapters', chapter), '../sum_data/test.txt')
-    call_abstractive_summarizer()
-    abstractive_sentences = process_text_out('../nats_results/summaries.txt',
-                                             'tmp.txt')
-    level = 0
+    if debug_names is None:
+        debug_names = [str(chapter) + '-aa' for chapter in range(len(chapter_segments))]
+    start_time = time.time()
+    abstractive_sentences = summarize_chapter_segments(
+        chapter_segments, debug_dir, [name + '0' for name in debug_names], batch_size)
+    if level_stats is not None:
+        level_stats.append({'level': 0, 'chapters': len(chapter_segments),
+                            'summarized': sum(len(segments) for segments in chapter_segments),
+                            'kept': 0, 'time': time.time() - start_time})
     thresh = 1 if small else 20
-    while num_segments > thresh and level < 4:
-        num_segments, book_text = process_text_in(
-            'tmp.txt', '../sum_data/test.txt')
-        call_abstractive_summarizer()
-        abstractive_sentences = process_text_out(
-            '../nats_results/summaries.txt', 'tmp.txt')
+    chapters = list(range(len(chapter_segments)))
+    # the tokens of the sentences, which are often kept from one level to the next
+    sentence_tokens = dict()
+    level = 0
+    while level < 4:
+        # summarize again the chapters where the summary has too many sentences
+        chapters = [chapter for chapter in chapters
+                    if len(abstractive_sentences[chapter]) - 1 > thresh]
+        if len(chapters) == 0:
+            break
+        start_time = time.time()
+        segments = []
+        level_chapters = []
+        new_sentences = dict()
+        num_kept = 0
+        for chapter in chapters:
+            sentences = abstractive_sentences[chapter]
+            for sentence in sentences:
+                if sentence not in sentence_tokens:
+                    sentence_tokens[sentence] = [
+                        token for sen in get_sentence_tokens(fold_text(sentence), segmenter)
+                        for token in clean_tokens(sen)]
+            tokens = [sentence_tokens[sentence] for sentence in sentences]
+            groups = [group for group in group_sentences(tokens) if len(group) > 0]
+            # each group becomes one sentence, a group of one sentence is kept
+            new_sentences[chapter] = [sentences[group[0]] if len(group) == 1 else None
+                                      for group in groups]
+            to_summarize = [create_segment(tokens, group) for group in groups
+                            if len(group) != 1]
+            num_kept += len(groups) - len(to_summarize)
+            if len(to_summarize) > 0:
+                segments.append(to_summarize)
+                level_chapters.append(chapter)
+            else:
+                abstractive_sentences[chapter] = new_sentences[chapter]
+        level_sentences = []
+        if len(segments) > 0:
+            level_sentences = summarize_chapter_segments(
+                segments, debug_dir,
+                [debug_names[chapter] + str(level + 1) for chapter in level_chapters],
+                batch_size)
+        for chapter, sentences in zip(level_chapters, level_sentences):
+            summarized = iter(sentences)
+            abstractive_sentences[chapter] = [
+                next(summarized) if sentence is None else sentence
+                for sentence in new_sentences[chapter]]
+        if level_stats is not None:
+            level_stats.append({'level': level + 1, 'chapters': len(chapters),
+                                'summarized': sum(len(segment) for segment in segments),
+                                'kept': num_kept, 'time': time.time() - start_time})
+        # the chapters where every segment was kept cannot be made shorter
+        chapters = level_chapters
         level += 1
     return abstractive_sentences
 
 
-def create_abstr_extr_summary_chapter(book_id, chapter, technique):
+def create_abstr_abstr_summary_chapter(book_id, chapter, small=True, parsed_chapter=None,
+                                       debug_dir=None, segmenter=SEGMENTER):
+    """
+    Create an abstractive summary from an abstractive summary.
+
+    Parameters:
+    book_id: (str) the book identifier
+    chapter: the chapter to summarize
+    small: how short to make the summary. small is 1 to 5 sentences, large is up to 20 sentences.
+    parsed_chapter: the ChapterAnalysis of the chapter, so the chapter is not parsed again
+    debug_dir: if given, the directory to save the input and output of each level in
+    segmenter: how the sentences are found, one of SEGMENTERS
+
+    Returns:
+    list: the sentences of the abstractive summary
+    """
+    segments = create_abstr_abstr_segments(book_id, chapter, parsed_chapter, segmenter)
+    return create_abstr_abstr_summaries(
+        [segments], small, debug_dir, [book_id + '-' + str(chapter) + '-aa'],
+        segmenter=segmenter)[0]
+
+
+def create_abstr_extr_segments(book_id, chapter, technique, document=None,
+                               segmenter=SEGMENTER):
+    """
+    Create the segments of a chapter for the abstractive summary from an extractive summary.
+
+    Parameters:
+    book_id: (str) the book identifier
+    chapter: the chapter to summarize
+    technique: the name of the extractive summarization technique
+    document: the SentenceTermMatrix or the sumy document for the chapter,
+    parsed from the chapter file if not given
+    segmenter: how the sentences are found, one of SEGMENTERS
+
+    Returns:
+    list: the segments of the extractive summary in the LeafNATS input form
+    """
+    quote = find_relevant_quote(book_id, chapter, 5, technique, document)
+    return text_to_segments(' '.join(str(q) + '\n' for q in quote), segmenter)
+
+
+def create_abstr_extr_summary_chapter(book_id, chapter, technique, document=None,
+                                      debug_dir=None, segmenter=SEGMENTER):
     """
     Create an abstractive summary from an extractive summary
 
     Parameters:
     book_id: (str) the book identifier
     chapter: the chapter to summarize
+    technique: the name of the extractive summarization technique
+    document: the sumy document for the chapter, parsed from the chapter file if not given
+    debug_dir: if given, the directory to save the input and output of the summarizer in
+    segmenter: how the sentences are found, one of SEGMENTERS
 
     Returns:
     list: the sentences of the abstractive summary
     """
-    if not exists('../sum_data'):
-        makedirs('../sum_data')
-    book_abstractive_summary_filename = '../sum_data/test.txt'
-    extractive_summary_filename = 'tmp_in.txt'
-    quote = find_relevant_quote(book_id, chapter, 5, technique)
-    with open(extractive_summary_filename, 'w') as extractive_summary:
-        for q in quote:
-            extractive_summary.write(str(q) + '\n')
-    num_segments = process_text_in(extractive_summary_filename,
-                                   book_abstractive_summary_filename)
-    call_abstractive_summarizer()
-    return(process_text_out('../nats_results/summaries.txt', 'tmp.txt'))
+    segments = create_abstr_extr_segments(book_id, chapter, technique, document, segmenter)
+    return summarize_segments(segments, debug_dir, book_id + '-' + str(chapter) + '-ae')
+
+
+def get_device(device='auto'):
+    """
+    Get the torch device to run the abstractive summarizer on.
+
+    Parameters:
+    device: cpu, cuda, a torch device name such as cuda:1, or auto to use the
+    first GPU if one is available and the CPU otherwise
+
+    Returns:
+    the torch device
+    """
+    if device == 'auto':
+        device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
+    return torch.device(device)
 
 
-def call_abstractive_summarizer():
+def set_torch_threads(threads=0, interop_threads=0):
     """
-    Call LeafNATS to create an abstractive summary using the pointer generator model.
-    Expects a file formatted with 
-    Output is saved in ../nats_results/summaries.txt
+    Set the number of threads torch uses on the CPU.
+
+    Parameters:
+    threads: the number of threads used within an operation, 0 keeps the torch default
+    interop_threads: the number of threads used between operations, 0 keeps the torch default
+    """
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0 and interop_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # can only be set once, before torch has started any parallel work
+            print("The torch interop threads are already set, using " +
+                  str(torch.get_num_interop_threads()))
+
+
+def inference_context():
+    """ Get the torch context for running the model without tracking gradients. """
+    if hasattr(torch, 'inference_mode'):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+def get_abstractive_args(device='auto'):
+    """
+    Get the LeafNATS arguments for the pointer generator model.
+
+    Parameters:
+    device: the device to run the model on, as given to get_device
+
+    Returns:
+    the argparse namespace with the default LeafNATS arguments
     """
     parser = argparse.ArgumentParser()
     '''
@@ -304,7 +651,7 @@ def call_abstractive_summarizer():
     User specified parameters.
     '''
     parser.add_argument(
-        '--device', default=torch.device("cuda:0"), help='device')
+        '--device', default=get_device(device), help='device')
     parser.add_argument('--file_vocab', default='vocab',
                         help='file store training vocabulary.')
 
@@ -356,6 +703,259 @@ def call_abstractive_summarizer():
                         help='directory that stores models.')
     parser.add_argument('--app_data_dir', default='../../',
                         help='directory that stores data.')
-    args = parser.parse_args([])
-    model = modelPointerGenerator(args)
-    model.test()
+    return parser.parse_args([])
+
+
+def get_model_key(args):
+    """
+    Get the epoch and batch of the model to use, as used in the model filenames.
+
+    Parameters:
+    args: the LeafNATS arguments
+
+    Returns:
+    str: the end of the model filenames, such as _0_0.model
+    """
+    if args.use_optimal_model:
+        with open(os.path.join('..', 'nats_results', 'model_validate.txt'), 'r') as model_valid:
+            arr = re.split(r'\s', model_valid.readline().rstrip('\n'))
+        return '_' + arr[1] + '_' + arr[2] + '.model'
+    arr = re.split(r'\D', args.model_optimal_key)
+    return '_' + arr[0] + '_' + arr[1] + '.model'
+
+
+def get_abstractive_model_version(quantize=False):
+    """
+    Get the version of the abstractive summarizer model, without loading the model.
+
+    Parameters:
+    quantize: whether the model is quantized to int8
+
+    Returns:
+    str: the model filename key, with the beam size and quantization used
+    """
+    args = get_abstractive_args()
+    version = get_model_key(args) + '-beam' + str(args.beam_size)
+    if quantize:
+        version += '-int8'
+    return version
+
+
+class AbstractiveSummarizer:
+    """
+    The LeafNATS pointer generator model, loaded once and kept in memory.
+
+    The vocabulary, the models and the model weights are loaded when the summarizer
+    is created, and each call to summarize only runs the beam search.
+    The decoding follows natsEnd2EndBase.test() in LeafNATS without reloading the model.
+    """
+
+    def __init__(self, args=None, quantize=False):
+        """
+        Parameters:
+        args: the LeafNATS arguments, the defaults from get_abstractive_args if not given
+        quantize: use a dynamically int8 quantized copy of the model, on the CPU only
+        """
+        self.args = args if args is not None else get_abstractive_args()
+        self.lock = Lock()
+        # the batches of each thread, as the summary service summarizes books in threads
+        self.thread_stats = local()
+        self.model = modelPointerGenerator(self.args)
+        self.model.build_vocabulary()
+        self.model.build_models()
+        self.load_weights()
+        if quantize:
+            self.quantize()
+
+    def load_weights(self):
+        """ Load the trained weights from ../nats_results into the models. """
+        model_key = get_model_key(self.args)
+        for model_name in self.model.train_models:
+            model_file = os.path.join('..', 'nats_results', model_name + model_key)
+            self.model.train_models[model_name].load_state_dict(torch.load(
+                model_file, map_location=lambda storage, loc: storage))
+            self.model.train_models[model_name].eval()
+
+    def quantize(self):
+        """
+        Quantize the LSTM and linear layers of the models to int8, which makes the beam
+        search faster on the CPU. The weights are quantized once, the activations are
+        quantized dynamically.
+        """
+        if self.args.device.type != 'cpu':
+            print("The abstractive summarizer can only be quantized on the CPU")
+            return
+        for model_name in self.model.train_models:
+            torch.quantization.quantize_dynamic(
+                self.model.train_models[model_name], {torch.nn.LSTM, torch.nn.Linear},
+                dtype=torch.qint8, inplace=True)
+
+    def decode_batch(self, batch_id):
+        """
+        Run the beam search on one batch.
+
+        Parameters:
+        batch_id: the batch to decode, from the batch files created by create_batch_file
+
+        Returns:
+        list: the LeafNATS output line for each segment in the batch
+        """
+        self.model.build_batch(batch_id)
+        beam_seq, beam_prb, beam_attn_ = self.model.test_worker()
+        trg_seq = beam_seq.data.cpu().numpy()
+        if self.args.copy_words:
+            beam_attn_ = beam_attn_.data.cpu().numpy()
+        id2vocab = self.model.batch_data['id2vocab']
+        ext_id2oov = self.model.batch_data['ext_id2oov']
+        lines = []
+        for b in range(trg_seq.shape[0]):
+            gen_text = [id2vocab[wd] if wd in id2vocab else ext_id2oov[wd]
+                        for wd in trg_seq[b, 0]][1:]
+            if self.args.copy_words:
+                # replace unknown words with the source word with the most attention
+                src_text = self.model.batch_data['src_txt'][b]
+                for j in range(len(gen_text)):
+                    if gen_text[j] == '<unk>':
+                        gen_text[j] = src_text[beam_attn_[b, 0, j].argmax()]
+            trg_text = ' '.join(self.model.batch_data['trg_txt'][b])
+            lines.append(' '.join(gen_text) + '<sec>' + trg_text)
+        return lines
+
+    def summarize(self, segments, batch_size=None):
+        """
+        Create abstractive summaries of segments of text.
+        Segments of similar length are decoded together in batches, so that little
+        of each batch is padding.
+
+        Parameters:
+        segments: the segments in the form expected by LeafNATS, as written by process_text_in
+        batch_size: the maximum number of segments in a beam search batch,
+        the LeafNATS test_batch_size if not given
+
+        Returns:
+        list: the LeafNATS output line for each segment, in the same order
+        """
+        if len(segments) == 0:
+            return []
+        if batch_size is None:
+            batch_size = self.args.test_batch_size
+        # sort the segments by length, so each batch holds segments of similar length
+        order = sorted(range(len(segments)), key=lambda i: len(segments[i].split()))
+        with self.lock:
+            # LeafNATS reads the batches from files, the filenames are unique to this
+            # process so that summarizers running in parallel do not overwrite each other
+            self.args.task = 'book_summarizer_' + str(os.getpid())
+            self.args.file_test = self.args.task + '.txt'
+            self.args.test_batch_size = batch_size
+            test_filename = os.path.join(self.args.data_dir, self.args.file_test)
+            makedirs(self.args.data_dir, exist_ok=True)
+            save_lines(test_filename, [segments[i] for i in order])
+            num_batches = create_batch_file(
+                path_data=self.args.data_dir,
+                path_work=os.path.join('..', 'nats_results'),
+                is_shuffle=False,
+                fkey_=self.args.task,
+                file_=self.args.file_test,
+                batch_size=batch_size)
+            sorted_summaries = []
+            try:
+                with inference_context():
+                    for batch_id in range(num_batches):
+                        start_time = time.time()
+                        batch_summaries = self.decode_batch(batch_id)
+                        batch_segments = order[len(sorted_summaries):
+                                               len(sorted_summaries) + len(batch_summaries)]
+                        self.batch_stats.append({
+                            'segments': len(batch_summaries),
+                            'max_tokens': max(len(segments[i].split()) for i in batch_segments),
+                            'time': time.time() - start_time})
+                        sorted_summaries.extend(batch_summaries)
+            finally:
+                os.remove(test_filename)
+                shutil.rmtree(os.path.join('..', 'nats_results', 'batch_' + self.args.task + '_' +
+                                           str(batch_size)), ignore_errors=True)
+        summaries = [''] * len(segments)
+        for i, summary in zip(order, sorted_summaries):
+            summaries[i] = summary
+        return summaries
+
+    @property
+    def batch_stats(self):
+        """ The statistics of the batches decoded in this thread since the last reset. """
+        if not hasattr(self.thread_stats, 'batches'):
+            self.thread_stats.batches = []
+        return self.thread_stats.batches
+
+    def reset_batch_stats(self):
+        """ Start the statistics of the batches again, such as for the next book. """
+        self.thread_stats.batches = []
+
+    def get_batch_stats(self):
+        """
+        Get the latency statistics of the beam search batches decoded in this thread
+        since the last reset.
+
+        Returns:
+        dict: the number of batches and segments, the total, mean and maximum batch time
+        in seconds, and the segments decoded per second
+        """
+        times = [stats['time'] for stats in self.batch_stats]
+        num_segments = sum(stats['segments'] for stats in self.batch_stats)
+        total_time = sum(times)
+        return {'batches': len(times),
+                'segments': num_segments,
+                'total_time': total_time,
+                'mean_batch_time': total_time / len(times) if times else 0.0,
+                'max_batch_time': max(times) if times else 0.0,
+                'segments_per_second': num_segments / total_time if total_time > 0 else 0.0}
+
+
+_abstractive_summarizer = None
+_abstractive_options = {'device': 'auto', 'quantize': False}
+
+
+def configure_abstractive_summarizer(device='auto', threads=0, interop_threads=0,
+                                     quantize=False):
+    """
+    Set how the abstractive summarizer for this process runs.
+    The device and quantization are used when the model is first loaded.
+
+    Parameters:
+    device: the device to run the model on, as given to get_device
+    threads: the number of CPU threads used within an operation, 0 keeps the torch default
+    interop_threads: the number of CPU threads used between operations,
+    0 keeps the torch default
+    quantize: use a dynamically int8 quantized copy of the model, on the CPU only
+    """
+    _abstractive_options['device'] = device
+    _abstractive_options['quantize'] = quantize
+    set_torch_threads(threads, interop_threads)
+
+
+def get_abstractive_summarizer():
+    """
+    Get the abstractive summarizer for this process, loading the model on first use.
+
+    Returns:
+    AbstractiveSummarizer: the summarizer shared by all the chapters and books
+    """
+    global _abstractive_summarizer
+    if _abstractive_summarizer is None:
+        with span('load abstractive model'):
+            _abstractive_summarizer = AbstractiveSummarizer(
+                get_abstractive_args(_abstractive_options['device']),
+                _abstractive_options['quantize'])
+    return _abstractive_summarizer
+
+
+def set_abstractive_summarizer(summarizer):
+    """
+    Set the abstractive summarizer for this process, such as a stand-in for the model
+    so that the benchmarks run without it.
+
+    Parameters:
+    summarizer: an object with the summarize, reset_batch_stats and get_batch_stats
+    methods of AbstractiveSummarizer, or None to load the model on next use
+    """
+    global _abstractive_summarizer
+    _abstractive_summarizer = summarizer
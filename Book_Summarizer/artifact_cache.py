@@ -0,0 +1,170 @@
+"""
+This file has the cache for the results of the summary features.
+Results are saved on disk, keyed by a hash of the text they were created from,
+the feature and the parameters used, so results are reused between runs.
+"""
+
+from hashlib import sha256
+import json
+import os
+import threading
+
+
+def text_digest(text):
+    """ Get the hash of a text, used to identify the text in the cache keys. """
+    return sha256(text.encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    """
+    A size bounded cache of json results on disk.
+
+    When the cache grows larger than the maximum size, the least recently used
+    results are removed. Results are written atomically, so the cache can be
+    shared by worker processes and threads. The size of the cache is found from the
+    cache directory on the first save, and then kept up to date with the saves of
+    this object, so one object should be used for all the saves of a process.
+    """
+
+    def __init__(self, cache_dir='../results/cache', max_size=500 * 1024 * 1024):
+        """
+        Parameters:
+        cache_dir: the directory for the cache, or None to disable the cache
+        max_size: the maximum size of the cache in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.size = None
+        self.size_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, digest, feature, params):
+        """
+        Get the cache key for a result.
+
+        Parameters:
+        digest: the text_digest of the text the result is created from
+        feature: the name of the summary feature
+        params: a dict of the parameters that change the result
+
+        Returns:
+        str: the cache key
+        """
+        key = json.dumps([digest, feature, params], sort_keys=True)
+        return text_digest(key)
+
+    def get_filename(self, key):
+        """ Get the filename for the cache key. """
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """
+        Get a result from the cache.
+
+        Parameters:
+        key: the cache key from make_key
+
+        Returns:
+        the result, or None if it is not in the cache
+        """
+        if self.cache_dir is None:
+            return None
+        filename = self.get_filename(key)
+        try:
+            with open(filename, 'r') as cache_file:
+                value = json.load(cache_file)
+            # mark as recently used
+            os.utime(filename)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Save a result in the cache, removing the least recently used results if needed.
+
+        Parameters:
+        key: the cache key from make_key
+        value: the result, which needs to be json serializable
+        """
+        if self.cache_dir is None:
+            return
+        filename = self.get_filename(key)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # the partial file is unique to the process and thread writing it
+        partial_filename = filename + '.' + str(os.getpid()) + '-' + str(threading.get_ident())
+        with open(partial_filename, 'w') as cache_file:
+            json.dump(value, cache_file)
+        file_size = os.path.getsize(partial_filename)
+        with self.size_lock:
+            # the size of a result that is replaced is no longer in the cache
+            replaced_size = 0
+            if os.path.exists(filename):
+                replaced_size = os.path.getsize(filename)
+            os.replace(partial_filename, filename)
+            if self.size is None:
+                self.size = self.get_size()
+            else:
+                self.size += file_size - replaced_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def get_or_compute(self, digest, feature, params, compute):
+        """
+        Get a result from the cache, computing and saving it if it is not in the cache.
+
+        Parameters:
+        digest: the text_digest of the text the result is created from
+        feature: the name of the summary feature
+        params: a dict of the parameters that change the result
+        compute: a function without arguments that computes the result
+
+        Returns:
+        the result
+        """
+        key = self.make_key(digest, feature, params)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def list_files(self):
+        """
+        List the results in the cache with their last use time and size.
+        The partial files of results that are still being written are not included.
+        """
+        files = []
+        for root, dirs, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    info = os.stat(os.path.join(root, filename))
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, os.path.join(root, filename)))
+        return files
+
+    def get_size(self):
+        """ Get the total size of the cache in bytes. """
+        return sum(size for mtime, size, filename in self.list_files())
+
+    def evict(self):
+        """ Remove the least recently used results until the cache is below 90% of the maximum size. """
+        files = sorted(self.list_files())
+        size = sum(size for mtime, size, filename in files)
+        for mtime, file_size, filename in files:
+            if size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                # already removed by another process
+                pass
+            size -= file_size
+        self.size = size
@@ -0,0 +1,521 @@
+"""
+This file has the benchmarks for parts of the book summarizer.
+The detokenizer benchmark times the conversion of LeafNATS output to readable text.
+The benchmark suite times each stage of the summarizer on a book and on copies of
+the book scaled up, and compares the results with a saved baseline.
+"""
+
+import argparse
+import glob
+import json
+import os
+import platform
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import exists, isfile
+from data import get_data_filename, save_clean_book, divide_book_into_chapters
+from data import get_results_filename, stream_book
+from abstractive_summarizer import summaries_to_text, process_text_in, process_text_out
+from abstractive_summarizer import detokenize_line, set_abstractive_summarizer
+from abstractive_summarizer import SPECIAL_TOKENS_REGEX, replace_special_token
+from entity_extraction import find_entities_book, find_entities_chapter
+from extractive_summarizer import find_relevant_quote, TECHNIQUES
+from nlp_models import load_nlp
+from profiler import get_peak_memory
+
+TOKEN_PATTERN = re.compile(r"n't|'\w+|\w+|[^\w\s]")
+BENCHMARK_DIR = '../results/benchmark'
+STAGES = ['save_clean_book', 'divide_book_into_chapters', 'find_entities_book',
+          'find_entities_chapter'] + \
+    ['find_relevant_quote-' + technique for technique in TECHNIQUES] + \
+    ['process_text_in', 'process_text_out', 'detokenize_line', 'summarize_book',
+     'analyze_summaries']
+# the features of the summary in the summarize_book and analyze_summaries stages
+SUMMARY_FLAGS = ['-fl', '-en', '-ex', '-ae', '-aa', '-w', '-noCache']
+
+
+class TinyAbstractiveSummarizer:
+    """
+    A stand-in for the abstractive summarizer, which takes the first words of each
+    segment as its summary, so that the benchmarks run without the LeafNATS model.
+    """
+
+    def __init__(self, num_words=20):
+        """
+        Parameters:
+        num_words: the number of words of each segment in its summary
+        """
+        self.num_words = num_words
+        self.batch_stats = []
+
+    def summarize(self, segments, batch_size=None):
+        """
+        Summarize the segments, in the LeafNATS output form.
+
+        Parameters:
+        segments: the segments in the form expected by LeafNATS
+        batch_size: not used, the segments are summarized together
+
+        Returns:
+        list: the summary of each segment
+        """
+        start_time = time.time()
+        summaries = []
+        for segment in segments:
+            words = segment.split('<sec>', 1)[-1].split(' ')[:self.num_words]
+            summaries.append('<s> ' + ' '.join(words) + ' . </s> <stop>')
+        self.batch_stats.append({'segments': len(segments), 'time': time.time() - start_time})
+        return summaries
+
+    def reset_batch_stats(self):
+        """ Start the statistics of the batches again, as AbstractiveSummarizer does. """
+        self.batch_stats = []
+
+    def get_batch_stats(self):
+        """
+        Get the statistics of the batches summarized since the last reset,
+        as AbstractiveSummarizer does.
+        """
+        times = [stats['time'] for stats in self.batch_stats]
+        num_segments = sum(stats['segments'] for stats in self.batch_stats)
+        total_time = sum(times)
+        return {'batches': len(times),
+                'segments': num_segments,
+                'total_time': total_time,
+                'mean_batch_time': total_time / len(times) if times else 0.0,
+                'max_batch_time': max(times) if times else 0.0,
+                'segments_per_second': num_segments / total_time if total_time > 0 else 0.0}
+
+
+def time_function(function, repeat=3):
+    """
+    Time a function, taking the best of several runs.
+
+    Parameters:
+    function: the function to time, called with no arguments
+    repeat: the number of times to run the function
+
+    Returns:
+    float: the shortest time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        if (best is None) or (duration < best):
+            best = duration
+    return best
+
+
+def create_summaries(book_id, num_lines=None):
+    """
+    Create lines in the form output by LeafNATS from the sentences of a book,
+    for benchmarking when there is no LeafNATS output file.
+
+    Parameters:
+    book_id: (str) the book identifier
+    num_lines: the number of lines to create, by default one for every three sentences
+
+    Returns:
+    list: the lines in the LeafNATS output form
+    """
+    with open(get_data_filename(book_id, 'books'), 'r') as book:
+        text = book.read().lower()
+    sentences = [sentence for sentence in re.split(r'(?<=[.!?])\s+', text)
+                 if len(sentence.strip()) > 0]
+    if num_lines is None:
+        num_lines = max(1, len(sentences) // 3)
+    summaries = []
+    for line_num in range(num_lines):
+        words = []
+        # a summary has a few sentences, like the abstractive summarizer output
+        for sentence in range(3):
+            sentence_text = sentences[(line_num * 3 + sentence) % len(sentences)]
+            words.append('<s> ' + ' '.join(TOKEN_PATTERN.findall(sentence_text)) + ' </s>')
+        summaries.append(' '.join(words) + ' <stop>\n')
+    return summaries
+
+
+def benchmark_detokenizer(summaries, repeat=3):
+    """
+    Time the conversion of LeafNATS output to readable text, and print the throughput.
+
+    Parameters:
+    summaries: the lines output by LeafNATS
+    repeat: the number of times to run the conversion, the best time is used
+
+    Returns:
+    float: the number of lines converted per second
+    """
+    num_bytes = sum(len(line.encode('utf-8')) for line in summaries)
+    duration = time_function(lambda: summaries_to_text(summaries), repeat)
+    lines_per_second = len(summaries) / duration
+    print("Detokenizer: {} lines ({:.1f} MB) in {:.3f}s, {:.0f} lines/s, {:.2f} MB/s".format(
+        len(summaries), num_bytes / 1000000, duration, lines_per_second,
+        num_bytes / 1000000 / duration))
+    return lines_per_second
+
+
+def get_scaled_book_id(book_id, scale):
+    """ Get the identifier of the copy of a book scaled for the benchmarks. """
+    return 'bench-' + book_id + '-x' + str(scale)
+
+
+def create_scaled_book(book_id, scale):
+    """
+    Create a book that is the clean text of a book repeated, with a chapter break
+    between the copies, and copy the ground truth summary of the book for it.
+    The book is also cleaned and divided into chapters, so any of the stages can run.
+
+    Parameters:
+    book_id: (str) the book identifier, which needs to have been processed
+    scale: the number of copies of the book
+
+    Returns:
+    str: the identifier of the scaled book
+    """
+    scaled_id = get_scaled_book_id(book_id, scale)
+    with open(get_data_filename(book_id, 'books'), 'rb') as book:
+        text = book.read()
+    with open(get_data_filename(scaled_id, 'raw_books'), 'wb') as scaled_book:
+        for copy in range(scale):
+            scaled_book.write(text)
+            scaled_book.write(b'\n\n\n')
+    if isfile(get_data_filename(book_id, 'summaries')):
+        shutil.copyfile(get_data_filename(book_id, 'summaries'),
+                        get_data_filename(scaled_id, 'summaries'))
+    save_clean_book(scaled_id)
+    divide_book_into_chapters(scaled_id)
+    return scaled_id
+
+
+def remove_book_files(book_id):
+    """ Remove the data and results files of a book created for the benchmarks. """
+    patterns = [get_data_filename(book_id, folder)
+                for folder in ['raw_books', 'books', 'summaries']] + \
+        [get_data_filename(book_id, 'book_chapters', '*')]
+    # the files of the book are named with the book identifier then - or .,
+    # so the files of another book whose identifier starts the same are kept
+    for folder in ['../results/summaries/', '../results/analysis/', '../results/profiles/']:
+        patterns += [folder + book_id + '-*', folder + book_id + '.*']
+    patterns.append(BENCHMARK_DIR + '/' + book_id + '-*')
+    for pattern in patterns:
+        for filename in glob.glob(pattern):
+            os.remove(filename)
+
+
+def count_chapters(book_id):
+    """ Get the number of chapter files of a book. """
+    num_chapters = 0
+    while isfile(get_data_filename(book_id, 'book_chapters', num_chapters)):
+        num_chapters += 1
+    return num_chapters
+
+
+def get_file_size(filename):
+    """ Get the size of a file in bytes. """
+    return os.path.getsize(filename)
+
+
+def get_summary_args(book_id):
+    """ Get the arguments for the summary created in the summarize_book stage. """
+    from book_summarizer import create_parser
+    return create_parser().parse_args(['-b', book_id] + SUMMARY_FLAGS)
+
+
+def prepare_stage(stage, book_id):
+    """
+    Load the models and inputs for a stage, so they are not included in its time.
+
+    Parameters:
+    stage: the name of the stage, one of STAGES
+    book_id: (str) the book identifier
+
+    Returns:
+    function: runs the stage and returns the size of its input in bytes
+    """
+    raw_filename = get_data_filename(book_id, 'raw_books')
+    book_filename = get_data_filename(book_id, 'books')
+    output_filename = BENCHMARK_DIR + '/' + book_id + '-' + stage + '.txt'
+    if stage == 'save_clean_book':
+        def run():
+            save_clean_book(book_id)
+            return get_file_size(raw_filename)
+    elif stage == 'divide_book_into_chapters':
+        def run():
+            divide_book_into_chapters(book_id)
+            return get_file_size(book_filename)
+    elif stage == 'find_entities_book':
+        load_nlp()
+        entities_filename = BENCHMARK_DIR + '/' + book_id + '-entities.json'
+
+        def run():
+            # the entities are saved for the find_entities_chapter stage
+            with open(entities_filename, 'w') as entities_file:
+                json.dump(find_entities_book(book_id), entities_file)
+            return get_file_size(book_filename)
+    elif stage == 'find_entities_chapter':
+        entities_filename = BENCHMARK_DIR + '/' + book_id + '-entities.json'
+        if isfile(entities_filename):
+            with open(entities_filename, 'r') as entities_file:
+                book_characters, book_entities = json.load(entities_file)
+        else:
+            book_characters, book_entities = find_entities_book(book_id)
+        load_nlp()
+        num_chapters = count_chapters(book_id)
+
+        def run():
+            for chapter in range(num_chapters):
+                find_entities_chapter(book_id, chapter, book_characters, book_entities)
+            return get_file_size(book_filename)
+    elif stage.startswith('find_relevant_quote-'):
+        technique = stage[len('find_relevant_quote-'):]
+        num_chapters = count_chapters(book_id)
+
+        def run():
+            for chapter in range(num_chapters):
+                find_relevant_quote(book_id, chapter, 1, technique)
+            return get_file_size(book_filename)
+    elif stage == 'process_text_in':
+        load_nlp()
+
+        def run():
+            process_text_in(book_filename, output_filename)
+            return get_file_size(book_filename)
+    elif stage == 'process_text_out':
+        summaries_filename = BENCHMARK_DIR + '/' + book_id + '-summaries.txt'
+        with open(summaries_filename, 'w') as summaries_file:
+            summaries_file.writelines(create_summaries(book_id))
+
+        def run():
+            process_text_out(summaries_filename, output_filename)
+            return get_file_size(summaries_filename)
+    elif stage == 'detokenize_line':
+        lines = [SPECIAL_TOKENS_REGEX.sub(replace_special_token, line.rstrip('\r\n'))
+                 for line in create_summaries(book_id)]
+
+        def run():
+            for line in lines:
+                detokenize_line(line)
+            return sum(len(line.encode('utf-8')) for line in lines)
+    elif stage == 'summarize_book':
+        from book_summarizer import summarize_book
+        args = get_summary_args(book_id)
+        load_nlp()
+
+        def run():
+            summarize_book(book_id, stream_book(book_id), args)
+            return get_file_size(raw_filename)
+    elif stage == 'analyze_summaries':
+        from book_summarizer import summarize_book, analyze_summaries
+        args = get_summary_args(book_id)
+        if not isfile(get_results_filename(book_id, args)):
+            summarize_book(book_id, stream_book(book_id), args)
+        load_nlp()
+
+        def run():
+            analyze_summaries(book_id, args)
+            return get_file_size(get_results_filename(book_id, args))
+    else:
+        raise ValueError("unknown stage " + stage)
+    return run
+
+
+def get_peak_rss():
+    """ Get the peak resident memory of this process in MB, or None if it is not available. """
+    return get_peak_memory()[0]
+
+
+def run_stage(stage, book_id, repeat=1, tiny_model=True):
+    """
+    Time a stage of the summarizer, run in a new process so that its peak memory
+    is measured on its own.
+
+    Parameters:
+    stage: the name of the stage, one of STAGES
+    book_id: (str) the book identifier
+    repeat: the number of times to run the stage, the best time is used
+    tiny_model: use the TinyAbstractiveSummarizer instead of the LeafNATS model
+
+    Returns:
+    dict: the stage, the best and mean time in seconds, the input size in MB,
+    the throughput in MB per second, and the peak memory in MB after the models and
+    inputs were loaded and after the stage ran
+    """
+    if not exists(BENCHMARK_DIR):
+        os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    if tiny_model:
+        set_abstractive_summarizer(TinyAbstractiveSummarizer())
+    run = prepare_stage(stage, book_id)
+    setup_rss = get_peak_rss()
+    times = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = run()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {'stage': stage, 'time': best, 'mean_time': sum(times) / len(times),
+            'size_mb': size / 1000000,
+            'mb_per_second': size / 1000000 / best if best > 0 else 0.0,
+            'setup_rss_mb': setup_rss, 'peak_rss_mb': get_peak_rss()}
+
+
+def run_suite(book_id, scales, stages, repeat=1, tiny_model=True, keep=False):
+    """
+    Run the benchmark stages on a book scaled up by each of the scales.
+
+    Parameters:
+    book_id: (str) the book identifier, which needs to have been processed
+    scales: the number of copies of the book in each benchmark book
+    stages: the names of the stages to run, in order
+    repeat: the number of times to run each stage, the best time is used
+    tiny_model: use the TinyAbstractiveSummarizer instead of the LeafNATS model
+    keep: keep the files of the scaled books
+
+    Returns:
+    list: the result of each stage for each scale
+    """
+    results = []
+    for scale in scales:
+        scaled_id = create_scaled_book(book_id, scale)
+        try:
+            for stage in stages:
+                # each stage runs in a new process, so models and memory are not shared
+                with ProcessPoolExecutor(max_workers=1,
+                                         mp_context=get_context('spawn')) as executor:
+                    result = executor.submit(
+                        run_stage, stage, scaled_id, repeat, tiny_model).result()
+                result['scale'] = scale
+                results.append(result)
+                peak_memory = 'unknown' if result['peak_rss_mb'] is None else \
+                    '{:.0f} MB'.format(result['peak_rss_mb'])
+                print("x{} {}: {:.3f}s, {:.2f} MB/s, {} peak memory".format(
+                    scale, stage, result['time'], result['mb_per_second'], peak_memory))
+        finally:
+            if not keep:
+                remove_book_files(scaled_id)
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2):
+    """
+    Compare the benchmark results with a baseline, and print the change in time.
+
+    Parameters:
+    results: the results from run_suite
+    baseline: the results of an earlier run
+    tolerance: the fraction of the baseline time that a stage can be slower by
+
+    Returns:
+    list: the stage and scale of the results that are slower than the baseline
+    """
+    baseline_times = {(result['stage'], result['scale']): result['time']
+                      for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result['stage'], result['scale'])
+        if key not in baseline_times or baseline_times[key] <= 0:
+            continue
+        change = result['time'] / baseline_times[key] - 1
+        slower = change > tolerance
+        if slower:
+            regressions.append(key)
+        print("x{} {}: {:.3f}s, baseline {:.3f}s, {:+.0%}{}".format(
+            result['scale'], result['stage'], result['time'], baseline_times[key], change,
+            ' slower' if slower else ''))
+    return regressions
+
+
+def save_results(filename, results, tiny_model):
+    """ Save the benchmark results to a json file. """
+    with open(filename, 'w') as results_file:
+        json.dump({'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(),
+                   'tiny_model': tiny_model,
+                   'results': results}, results_file, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark parts of the book summarizer')
+    parser.add_argument(
+        "-f", "--file", help="the LeafNATS output file to detokenize, such as a -out.txt " \
+        "file saved with -abstrDebug (default is lines created from the book)")
+    parser.add_argument(
+        "-b", "--book", help="the book used to create the lines to detokenize, or the " \
+        "benchmark books (default is 11)", default='11')
+    parser.add_argument(
+        "-n", "--lines", help="the number of lines to create (default is 100000)",
+        type=int, default=100000)
+    parser.add_argument(
+        "-r", "--repeat", help="the number of times to run each benchmark " \
+        "(default is 3, or 1 for the suite)", type=int, default=None)
+    parser.add_argument(
+        "-suite", help="run the benchmark suite of the summarizer stages", action="store_true")
+    parser.add_argument(
+        "-scales", help="for the suite, the sizes of the benchmark books, as the number " \
+        "of copies of the book (default is 1,10,100)", default='1,10,100')
+    parser.add_argument(
+        "-stages", help="for the suite, the stages to run separated by commas, a name " \
+        "also selects the stages it starts, such as find_relevant_quote (default is all)",
+        default='')
+    parser.add_argument(
+        "-realModel", help="for the suite, use the LeafNATS model instead of a tiny " \
+        "stand-in", action="store_true")
+    parser.add_argument(
+        "-o", "--output", help="for the suite, the json file to save the results in " \
+        "(default is results/benchmark/results.json)", default=BENCHMARK_DIR + '/results.json')
+    parser.add_argument(
+        "-baseline", help="for the suite, the json file of the results to compare with " \
+        "(default is results/benchmark/baseline.json)", default=BENCHMARK_DIR + '/baseline.json')
+    parser.add_argument(
+        "-saveBaseline", help="for the suite, also save the results as the baseline",
+        action="store_true")
+    parser.add_argument(
+        "-keep", help="for the suite, keep the files of the benchmark books",
+        action="store_true")
+    args = parser.parse_args()
+    if (args.suite or args.file is None) and not exists(get_data_filename(args.book, 'books')):
+        print("Book " + args.book + " has not been processed, run python book_summarizer.py -b " +
+              args.book + " first")
+        return
+    if args.suite:
+        stages = STAGES
+        if len(args.stages) > 0:
+            names = args.stages.split(',')
+            stages = [stage for stage in STAGES if any(stage.startswith(name) for name in names)]
+        scales = [int(scale) for scale in args.scales.split(',')]
+        if not exists(BENCHMARK_DIR):
+            os.makedirs(BENCHMARK_DIR)
+        tiny_model = not args.realModel
+        # the suite times each stage once by default, the stages are long
+        repeat = 1 if args.repeat is None else args.repeat
+        results = run_suite(args.book, scales, stages, repeat, tiny_model, args.keep)
+        save_results(args.output, results, tiny_model)
+        if isfile(args.baseline) and not args.saveBaseline:
+            with open(args.baseline, 'r') as baseline_file:
+                baseline = json.load(baseline_file)
+            regressions = compare_with_baseline(results, baseline['results'])
+            print(str(len(regressions)) + " stages slower than the baseline")
+        if args.saveBaseline:
+            save_results(args.baseline, results, tiny_model)
+        return
+    if args.file is not None:
+        if not exists(args.file):
+            print("File " + args.file + " does not exist")
+            return
+        with open(args.file, 'r') as summaries_file:
+            summaries = summaries_file.readlines()
+    else:
+        summaries = create_summaries(args.book, args.lines)
+    benchmark_detokenizer(summaries, 3 if args.repeat is None else args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,133 +3,389 @@ This file is the entry point for calling the book summarizer
 Create a summary of the book with features defined with command line arguments. 
 """
 
-from entity_extraction import find_entities_book, find_entities_chapter, create_sentence
-from entity_extraction import save_sorted_entities_book, save_sorted_entities_chapter
-from data import first_lines_chapter, process_book, get_data_filename
-from data import get_results_filename, get_analysis_filename
-from extractive_summarizer import find_relevant_quote
-from abstractive_summarizer import create_abstr_extr_summary_chapter, create_abstr_abstr_summary_chapter
-from os import listdir, makedirs
+from entity_extraction import find_entities_book
+from entity_extraction import match_entities_chapter, find_entities_book_from_chapters
+from entity_extraction import CHUNK_SIZE
+from data import stream_book, get_data_filename, Chapter
+from data import get_results_filename, get_analysis_filename, get_entities_filename
+from data import get_profile_filename, get_records_filename
+from extractive_summarizer import find_relevant_quote, get_techniques, TECHNIQUES, QUOTE_VERSION
+from abstractive_summarizer import create_abstr_extr_segments, create_abstr_abstr_segments
+from abstractive_summarizer import summarize_chapter_segments, create_abstr_abstr_summaries
+from abstractive_summarizer import get_abstractive_summarizer, configure_abstractive_summarizer
+from abstractive_summarizer import get_abstractive_model_version, SEGMENTERS, SEGMENTS_VERSION
+from artifact_cache import ArtifactCache, text_digest
+from chapter_analysis import ChapterAnalysis
+from summary_records import SummaryRecordWriter, create_book_record, create_chapter_record
+from summary_records import create_abstractive_record, render_summary, save_entities
+from summary_vectors import load_summary, score_summary
+from profiler import span, collect_spans, trace_iter, create_profile, save_profile
+from os import listdir, makedirs, replace
+from os.path import splitext
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
 from os.path import isfile, join, exists
-from spacy import load
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.models import TfDocumentModel
-from sumy.evaluation import cosine_similarity
+from nlp_models import get_model_version
 import csv
+import json
 import argparse
+import time
+import traceback
 
 
-def summarize_book(book_id, num_chapters, args):
+# the caches of this process, so the size of the cache directory is only found once
+_caches = dict()
+
+
+def get_cache(args):
     """
-    Summarize the book using the features specified in the command line arguments.
-    
+    Get the cache for the chapter results, shared by all the chapters and books
+    summarized in this process.
+
+    Parameters:
+    args: the command line arguments provided
+
+    Returns:
+    ArtifactCache: the cache, which does not save anything if -noCache is used
+    """
+    cache_dir = None if args.noCache else '../results/cache'
+    key = (cache_dir, args.cacheSize)
+    if key not in _caches:
+        _caches[key] = ArtifactCache(cache_dir, args.cacheSize * 1024 * 1024)
+    return _caches[key]
+
+
+def get_abstr_params(args, feature):
+    """
+    Get the parameters that change an abstractive summary, used in its cache key.
+
+    Parameters:
+    args: the command line arguments provided
+    feature: abstr_extr or abstr_abstr
+
+    Returns:
+    dict: the parameters
+    """
+    # the segments for the summarizer depend on the spaCy sentences
+    params = {'model': get_abstractive_model_version(args.quantize),
+              'spacy': get_model_version(), 'segmenter': args.segmenter,
+              'segments': SEGMENTS_VERSION}
+    if feature == 'abstr_extr':
+        params['technique'] = get_techniques(args.exTechnique)[0]
+    else:
+        params['small'] = args.aa == 's'
+    return params
+
+
+def add_chapter_entities(chapter_summary, book_characters, book_entities):
+    """
+    Match the entities of a chapter to the book entities and add them to the chapter record,
+    when the book entities were found from the entities of the chapters.
+
+    Parameters:
+    chapter_summary: the result of summarize_chapter for the chapter, updated
+    book_characters: the characters that were found in the whole book
+    book_entities: the key words that were found in the whole book
+    """
+    record = chapter_summary['record']
+    record['characters'], record['entities'] = match_entities_chapter(
+        chapter_summary['chapter_ents'], book_characters, book_entities)
+
+
+def summarize_chapter(book_id, chapter, args, book_characters=None, book_entities=None):
+    """
+    Summarize one chapter of the book using the features specified in the command line arguments.
+    The chapters of a book are independent given the book entities, so this can run
+    in a worker process.
+    Results in the cache for the same chapter text and parameters are not computed again.
+
     Parameters:
     book_id: (str) the book identifier
-    num_chapters: the number of chapters the book has been divided into
+    chapter: the Chapter from stream_book, or the chapter number to read the chapter file
     args: the command line arguments provided
-    
-    Outputs:
-    Saves the summary to file, with the name of the file determined by the arguments.
+    book_characters: the characters that were found in the whole book, needed for -en
+    book_entities: the key words that were found in the whole book, needed for -en
+
+    Returns:
+    dict: the chapter record of the summary, without the abstractive summaries (record),
+    with -enFromChapters the entities found in the chapter before they are matched
+    to the book entities (chapter_ents),
+    the hash of the chapter text (digest), and for -ae and -aa the abstractive
+    summaries found in the cache (abstr_extr, abstr_abstr) or otherwise the segments
+    for the abstractive summarizer (abstr_extr_segments, abstr_abstr_segments),
+    and with -profile the spans timing the stages of the chapter (spans)
     """
-    if not exists('../results/summaries'):
-        makedirs('../results/summaries')
-    summary_filename = get_results_filename(book_id, args)
-    if not (isfile(summary_filename) and not args.w):
-        with open(summary_filename, 'w') as complete_summary:
-            if args.en:
-                # find characters and key words for book
-                book_characters, book_entities = find_entities_book(book_id)
-                # Print out sentence for characters and key words
-                line = create_sentence(
-                    book_characters, about_book=True, about_characters=True)
-                complete_summary.write(line + '\n')
-                line = create_sentence(
-                    book_entities, about_book=True, about_characters=False)
-                complete_summary.write(line + '\n')
-                save_sorted_entities_book(book_characters, book_entities, book_id)
-                complete_summary.write('\n')
-            # for each chapter
-            for chapter in range(num_chapters):
-                line = "Chapter " + str(chapter)
-                complete_summary.write(line + '\n')
-                if args.fl:
-                    line = "Starting:"
-                    complete_summary.write(line + '\n')
-                    # find first two non-empty lines of chapter
-                    # Print first two non-empty lines of chapter
-                    line = first_lines_chapter(book_id, chapter)
-                    complete_summary.write(line)
-                if args.en:
-                    # find characters and key words
-                    chapter_characters, chapter_entities = find_entities_chapter(
-                        book_id, chapter, book_characters, book_entities)
-                    save_sorted_entities_chapter(
-                        chapter_characters, chapter_entities, book_id, chapter)
-                    # Print sentence for characters and key words from chapter
-                    line = create_sentence(
-                        chapter_characters, about_book=False, about_characters=True)
-                    if (len(line) > 0):
-                        complete_summary.write(line + '\n')
-                    line = create_sentence(
-                        chapter_entities, about_book=False, about_characters=False)
-                    if (len(line) > 0):
-                        complete_summary.write(line + '\n')
-                if int(args.ex) != 0:
-                    # find quote using extractive summary techniques
-                    quote = find_relevant_quote(book_id, chapter, int(args.ex), args.exTechnique)
-                    # Print quote from chapter
-                    if len(quote) == 1:
-                        complete_summary.write('Quote: ')
+    start_time = time.time()
+    chapter_num = chapter.index if isinstance(chapter, Chapter) else chapter
+    with collect_spans(args.profile, chapter_num) as spans:
+        cache = get_cache(args)
+        # read the chapter once, parsing is shared by all the features
+        if isinstance(chapter, Chapter):
+            parsed_chapter = ChapterAnalysis(book_id, chapter.index, chapter.lines)
+            chapter = chapter.index
+        else:
+            parsed_chapter = ChapterAnalysis(book_id, chapter)
+        digest = parsed_chapter.digest
+        record = create_chapter_record(chapter)
+        chapter_summary = {'digest': digest, 'record': record,
+                           'abstr_extr': None, 'abstr_extr_segments': [],
+                           'abstr_abstr': None, 'abstr_abstr_segments': []}
+        if args.fl:
+            # find first two non-empty lines of chapter
+            with span('first lines'):
+                record['first_lines'] = parsed_chapter.first_lines
+        if args.en and args.enFromChapters:
+            # the book entities are found from the entities of all the chapters,
+            # so the chapter entities are matched to them in add_chapter_entities
+            with span('entities'):
+                chapter_summary['chapter_ents'] = cache.get_or_compute(
+                    digest, 'chapter_ents', {'model': get_model_version()},
+                    lambda: [[ent.text, ent.label_] for ent in parsed_chapter.entities])
+        elif args.en:
+            # find characters and key words, the result depends on the book entities too
+            params = {'model': get_model_version(),
+                      'book': text_digest(json.dumps([book_characters, book_entities]))}
+            with span('entities'):
+                record['characters'], record['entities'] = cache.get_or_compute(
+                    digest, 'entities', params, lambda: match_entities_chapter(
+                        parsed_chapter.entities, book_characters, book_entities))
+        if int(args.ex) != 0:
+            # find quote using extractive summary techniques,
+            # the techniques share the sentence term matrix of the chapter
+            record['quotes'] = []
+            for technique in get_techniques(args.exTechnique):
+                def find_quote():
+                    return [str(q) for q in find_relevant_quote(
+                        book_id, chapter, int(args.ex), technique, parsed_chapter.sentence_terms)]
+                with span('extractive ' + technique):
+                    if technique == 'random':
+                        # a new random quote is chosen each time
+                        quote = find_quote()
                     else:
-                        complete_summary.write('Quotes:\n')
-                    for q in quote:
-                        line = '"' + str(q) + '"'
-                        complete_summary.write(line + '\n')
-                if args.ae:
-                    # Print abstractive summary for chapter
-                    abstr_extr_summary = create_abstr_extr_summary_chapter(
-                        book_id, chapter, args.exTechnique)
-                    for line in abstr_extr_summary:
-                        complete_summary.write(line)
-                if args.aa != 'n':
-                    abstr_abstr_summary = create_abstr_abstr_summary_chapter(
-                        book_id, chapter, args.aa == 's')
-                    for line in abstr_abstr_summary:
-                        complete_summary.write(line)
-                complete_summary.write('\n')
-    if args.analysis:
-        analyze_summaries(book_id, args)
+                        params = {'technique': technique, 'sentences': int(args.ex),
+                                  'version': QUOTE_VERSION}
+                        quote = cache.get_or_compute(digest, 'quote', params, find_quote)
+                record['quotes'].append([technique, quote])
+        # the abstractive summaries are created for all the chapters together,
+        # only the segments for the summarizer are prepared for each chapter
+        if args.ae:
+            chapter_summary['abstr_extr'] = cache.get(cache.make_key(
+                digest, 'abstr_extr', get_abstr_params(args, 'abstr_extr')))
+            if chapter_summary['abstr_extr'] is None:
+                with span('abstractive from extractive segments'):
+                    chapter_summary['abstr_extr_segments'] = create_abstr_extr_segments(
+                        book_id, chapter, get_techniques(args.exTechnique)[0],
+                        parsed_chapter.sentence_terms, args.segmenter)
+        if args.aa != 'n':
+            chapter_summary['abstr_abstr'] = cache.get(cache.make_key(
+                digest, 'abstr_abstr', get_abstr_params(args, 'abstr_abstr')))
+            if chapter_summary['abstr_abstr'] is None:
+                with span('abstractive from abstractive segments'):
+                    chapter_summary['abstr_abstr_segments'] = create_abstr_abstr_segments(
+                        book_id, chapter, parsed_chapter, args.segmenter)
+    chapter_summary['spans'] = spans
+    record['time'] = time.time() - start_time
+    return chapter_summary
 
 
-def load_summary(filename):
+def summarize_chapters_abstractive(book_id, chapter_summaries, args):
     """
-    Load the summary for analysis.
-    
+    Create the abstractive summaries for all the chapters of the book.
+    The segments of all the chapters that are not in the cache are summarized together,
+    in beam search batches of up to -abstrBatchSize segments.
+
     Parameters:
-    filename: the filename of the summary text file
-    
+    book_id: (str) the book identifier
+    chapter_summaries: the results of summarize_chapter for each chapter
+    args: the command line arguments provided
+
     Returns:
-    Spacy processed text and sumy processed text for analysis.
+    list: for each chapter, the abstractive summary from an extractive summary
+    list: for each chapter, the abstractive summary from an abstractive summary
     """
-    spacy_available = True
-    try:
-        nlp = load('en_core_web_lg')
-    except:
-        spacy_available = False
-    if not isfile(filename):
-        return '', ''
-    if spacy_available:
-        with open(filename, 'r') as summary_file:
-            summary_text = ' '.join(summary_file)
-            summary_doc = nlp(summary_text)
+    num_chapters = len(chapter_summaries)
+    abstr_extr_summaries = [[] for chapter in range(num_chapters)]
+    abstr_abstr_summaries = [[] for chapter in range(num_chapters)]
+    cache = get_cache(args)
+    summarized = False
+    for feature, summaries in [('abstr_extr', abstr_extr_summaries),
+                               ('abstr_abstr', abstr_abstr_summaries)]:
+        if (feature == 'abstr_extr' and not args.ae) or \
+                (feature == 'abstr_abstr' and args.aa == 'n'):
+            continue
+        # use the summaries from the cache, and summarize the other chapters together
+        todo = []
+        for chapter, chapter_summary in enumerate(chapter_summaries):
+            if chapter_summary[feature] is None:
+                todo.append(chapter)
+            else:
+                summaries[chapter] = chapter_summary[feature]
+        if len(todo) == 0:
+            continue
+        if not summarized:
+            configure_abstractive_summarizer(
+                args.device, args.threads, args.interopThreads, args.quantize)
+            # the statistics are reported for this book only
+            get_abstractive_summarizer().reset_batch_stats()
+            summarized = True
+        segments = [chapter_summaries[chapter][feature + '_segments'] for chapter in todo]
+        if feature == 'abstr_extr':
+            with span('abstractive from extractive'):
+                new_summaries = summarize_chapter_segments(
+                    segments, args.abstrDebug,
+                    [book_id + '-' + str(chapter) + '-ae' for chapter in todo],
+                    args.abstrBatchSize)
+        else:
+            level_stats = []
+            with span('abstractive from abstractive'):
+                new_summaries = create_abstr_abstr_summaries(
+                    segments, args.aa == 's', args.abstrDebug,
+                    [book_id + '-' + str(chapter) + '-aa' for chapter in todo],
+                    args.abstrBatchSize, args.segmenter, level_stats)
+            for stats in level_stats:
+                print("Abstractive summary level {}: {} chapters, {} segments summarized, "
+                      "{} kept, {:.2f}s".format(stats['level'], stats['chapters'],
+                                                stats['summarized'], stats['kept'],
+                                                stats['time']))
+        params = get_abstr_params(args, feature)
+        for chapter, lines in zip(todo, new_summaries):
+            summaries[chapter] = lines
+            cache.put(cache.make_key(chapter_summaries[chapter]['digest'], feature, params),
+                      lines)
+    if summarized:
+        stats = get_abstractive_summarizer().get_batch_stats()
+        print("Abstractive summarizer: {} segments in {} batches, {:.2f}s mean batch time, "
+              "{:.2f}s max batch time, {:.2f} segments/s".format(
+                  stats['segments'], stats['batches'], stats['mean_batch_time'],
+                  stats['max_batch_time'], stats['segments_per_second']))
+    return abstr_extr_summaries, abstr_abstr_summaries
+
+
+def summarize_chapters(book_id, chapters, args, book_characters=None, book_entities=None):
+    """
+    Summarize all the chapters of the book, using a pool of worker processes
+    when more than one worker is requested.
+
+    Parameters:
+    book_id: (str) the book identifier
+    chapters: the chapters of the book, as Chapters from stream_book or chapter numbers
+    args: the command line arguments provided
+    book_characters: the characters that were found in the whole book, needed for -en
+    book_entities: the key words that were found in the whole book, needed for -en
+
+    Returns:
+    iterator: the results of summarize_chapter for each chapter, in chapter order
+    """
+    workers = max(1, int(args.workers))
+    summarize = partial(summarize_chapter, book_id, args=args,
+                        book_characters=book_characters, book_entities=book_entities)
+    if workers == 1:
+        # each chapter is summarized as soon as it is divided from the book
+        for chapter_summary in map(summarize, chapters):
+            yield chapter_summary
     else:
-        summary_doc = ''
-    summary_parser = PlaintextParser.from_file(
-        filename, Tokenizer("english"))
-    summary_model = TfDocumentModel(
-        str(summary_parser.document.sentences), Tokenizer("en"))
-    return summary_doc, summary_model
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map returns the results in chapter order, whichever worker finishes first
+            for chapter_summary in executor.map(summarize, chapters):
+                yield chapter_summary
+
+
+def summarize_book(book_id, chapters, args):
+    """
+    Summarize the book using the features specified in the command line arguments.
+    
+    Parameters:
+    book_id: (str) the book identifier
+    chapters: the chapters of the book, as Chapters from stream_book or chapter numbers
+    args: the command line arguments provided
+
+    Returns:
+    int: the number of chapters summarized, 0 if the summary already exists
+    
+    Outputs:
+    Saves the summary to file, with the name of the file determined by the arguments,
+    and the records of the summary as JSON Lines, written as each chapter is summarized.
+    With -profile, saves the time of each stage and the peak memory of the process to results/profiles.
+    """
+    num_chapters = 0
+    if not exists('../results/summaries'):
+        makedirs('../results/summaries')
+    start_time = time.time()
+    with collect_spans(args.profile) as spans:
+        summary_filename = get_results_filename(book_id, args)
+        if not (isfile(summary_filename) and not args.w):
+            # the records are written as the chapters are summarized,
+            # and the text summary and entities csv are created from them
+            with SummaryRecordWriter(get_records_filename(book_id, args)) as records:
+                book_characters = None
+                book_entities = None
+                chapter_summaries = []
+                if args.en and args.enFromChapters:
+                    # each chapter is parsed once, and the book entities are found
+                    # from the entities of all the chapters
+                    chapter_summaries = list(summarize_chapters(
+                        book_id, trace_iter(chapters, 'read chapters'), args))
+                    with span('book entities'):
+                        book_characters, book_entities = find_entities_book_from_chapters(
+                            [chapter_summary['chapter_ents']
+                             for chapter_summary in chapter_summaries])
+                        for chapter_summary in chapter_summaries:
+                            add_chapter_entities(chapter_summary, book_characters, book_entities)
+                    records.write(create_book_record(book_id, book_characters, book_entities))
+                    for chapter_summary in chapter_summaries:
+                        records.write(chapter_summary['record'])
+                else:
+                    if args.en:
+                        # the whole book is needed for the book entities before any chapter
+                        chapters = list(trace_iter(chapters, 'read chapters'))
+                        # find characters and key words for book
+                        with span('book entities'):
+                            with open(get_data_filename(book_id, 'books'), 'r') as book:
+                                book_digest = text_digest(book.read())
+                            book_characters, book_entities = get_cache(args).get_or_compute(
+                                book_digest, 'book_entities',
+                                {'model': get_model_version(), 'chunk_size': CHUNK_SIZE},
+                                lambda: find_entities_book(
+                                    book_id, args.nerBatchSize, args.nerProcesses))
+                    records.write(create_book_record(book_id, book_characters, book_entities))
+                    # for each chapter, in chapter order, as soon as it is summarized
+                    for chapter_summary in summarize_chapters(
+                            book_id, trace_iter(chapters, 'read chapters'), args,
+                            book_characters, book_entities):
+                        records.write(chapter_summary['record'])
+                        chapter_summaries.append(chapter_summary)
+                num_chapters = len(chapter_summaries)
+                abstr_extr_summaries, abstr_abstr_summaries = summarize_chapters_abstractive(
+                    book_id, chapter_summaries, args)
+                if args.ae or args.aa != 'n':
+                    for chapter, chapter_summary in enumerate(chapter_summaries):
+                        records.write(create_abstractive_record(
+                            chapter_summary['record']['chapter'],
+                            abstr_extr_summaries[chapter] if args.ae else None,
+                            abstr_abstr_summaries[chapter] if args.aa != 'n' else None))
+            with span('write summary'):
+                if args.en:
+                    save_entities(book_id, records.records)
+                # write to a partial file first, so that an interrupted run leaves no summary
+                # and the book is summarized again when the corpus is resumed
+                partial_filename = summary_filename + '.part'
+                with open(partial_filename, 'w') as complete_summary:
+                    complete_summary.write(render_summary(records.records))
+                replace(partial_filename, summary_filename)
+            # the spans of the chapters are collected where each chapter is summarized
+            if spans is not None:
+                for chapter_summary in chapter_summaries:
+                    spans.extend(chapter_summary['spans'])
+        if args.analysis:
+            with span('analysis'):
+                analyze_summaries(book_id, args)
+    if num_chapters > 0 and spans is not None:
+        if not exists('../results/profiles'):
+            makedirs('../results/profiles')
+        save_profile(create_profile(book_id, spans, time.time() - start_time),
+                     get_profile_filename(book_id, args, 'json'),
+                     get_profile_filename(book_id, args, 'csv'))
+    return num_chapters
 
 
 def analyze_summaries(book_id, args):
@@ -147,27 +403,182 @@ def analyze_summaries(book_id, args):
     """
     if not exists('../results/analysis'):
         makedirs('../results/analysis')
-    analysis_data = []
-    summary_doc, summary_model = load_summary(get_data_filename(book_id, 'summaries'))
-    new_summary_doc, new_summary_model = load_summary(get_results_filename(book_id, args))
-    if summary_doc != '':
-        if new_summary_doc != '':
-            analysis_data.append(
-                ['word embeddings similarity', summary_doc.similarity(new_summary_doc)])
-    if summary_model != '':
-        if new_summary_model != '':
-            analysis_data.append(
-                ['cosine similarity', cosine_similarity(summary_model, new_summary_model)])
+    cache = get_cache(args)
+    analysis_data = score_summary(
+        load_summary(get_data_filename(book_id, 'summaries'), cache),
+        load_summary(get_results_filename(book_id, args), cache))
     with open(get_analysis_filename(book_id, args), 'w') as csvFile:
         writer = csv.writer(csvFile)
         writer.writerows(analysis_data)
 
 
-def main():
+def get_summary_variants(book_id):
     """
-    Command line interface for the book summarizer
+    Get the summaries of a book in results/summaries, created with any features.
 
-    The user specifies which elements to include in the summary.
+    Parameters:
+    book_id: (str) the book identifier
+
+    Returns:
+    list: the names of the summaries without the .txt extension, such as 11-fl-en
+    """
+    if not exists('../results/summaries'):
+        return []
+    return sorted(splitext(f)[0] for f in listdir('../results/summaries')
+                  if f.endswith('.txt') and
+                  (f == book_id + '.txt' or f.startswith(book_id + '-')))
+
+
+def analyze_summary_variants(book_id, args):
+    """
+    Analyze all the summaries of a book in one pass, whatever features they were
+    created with. The ground truth summary is loaded once for all the summaries.
+
+    Parameters:
+    book_id: (str) the book identifier
+    args: the command line arguments provided
+
+    Returns:
+    int: the number of summaries analyzed
+
+    Outputs:
+    Saves the analysis of each summary to a csv file in the results/analysis directory,
+    as analyze_summaries does, and a table of all the summaries to <book_id>-variants.csv
+    """
+    if not exists('../results/analysis'):
+        makedirs('../results/analysis')
+    cache = get_cache(args)
+    summary_vectors = load_summary(get_data_filename(book_id, 'summaries'), cache)
+    rows = []
+    for variant in get_summary_variants(book_id):
+        analysis_data = score_summary(summary_vectors, load_summary(
+            '../results/summaries/' + variant + '.txt', cache))
+        with open('../results/analysis/' + variant + '.csv', 'w') as csvFile:
+            writer = csv.writer(csvFile)
+            writer.writerows(analysis_data)
+        scores = dict(analysis_data)
+        rows.append([variant, scores.get('word embeddings similarity', ''),
+                     scores.get('cosine similarity', '')])
+    with open('../results/analysis/' + book_id + '-variants.csv', 'w') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(['summary', 'word embeddings similarity', 'cosine similarity'])
+        writer.writerows(rows)
+    return len(rows)
+
+
+def is_book_complete(book_id, args):
+    """
+    Check if all the outputs for the book already exist for the features in args.
+
+    Parameters:
+    book_id: (str) the book identifier
+    args: the command line arguments, used to determine the output filenames
+
+    Returns:
+    bool: True if the book does not need to be summarized again
+    """
+    if args.w:
+        return False
+    filenames = [get_results_filename(book_id, args)]
+    if args.en:
+        filenames.append(get_entities_filename(book_id))
+    if args.analysis:
+        filenames.append(get_analysis_filename(book_id, args))
+    return all(isfile(filename) for filename in filenames)
+
+
+def process_and_summarize_book(book_id, args):
+    """
+    Break the book down into chapters and summarize it.
+    Any error is caught and returned, so that one book does not stop a batch of books.
+
+    Parameters:
+    book_id: (str) the book identifier
+    args: the command line arguments provided
+
+    Returns:
+    str: the book identifier
+    int: the number of chapters in the book
+    float: the time taken in seconds
+    str: the error message if the book failed, otherwise an empty string
+    """
+    start_time = time.time()
+    num_chapters = 0
+    error = ''
+    try:
+        if isfile(get_data_filename(book_id, 'raw_books')):
+            num_chapters = summarize_book(
+                book_id, stream_book(book_id, args.exportChapters), args)
+        else:
+            error = 'book not found'
+    except Exception:
+        error = traceback.format_exc()
+    return book_id, num_chapters, time.time() - start_time, error
+
+
+def summarize_corpus(book_ids, args):
+    """
+    Summarize a batch of books, using a pool of worker processes when more than one
+    book worker is requested.
+
+    Books that already have all their outputs are skipped, so an interrupted batch
+    can be resumed. A book that fails is reported and the rest of the batch continues.
+    The progress and throughput are printed as each book finishes.
+
+    Parameters:
+    book_ids: the identifiers of the books in data/raw_books to summarize
+    args: the command line arguments provided
+
+    Returns:
+    list: the identifiers of the books that failed
+    """
+    todo = [book_id for book_id in book_ids if not is_book_complete(book_id, args)]
+    print("Summarizing " + str(len(todo)) + " books, skipping " +
+          str(len(book_ids) - len(todo)) + " already complete")
+    start_time = time.time()
+    num_done = 0
+    num_chapters_done = 0
+    failed = []
+
+    def report(result):
+        nonlocal num_done, num_chapters_done
+        book_id, num_chapters, book_time, error = result
+        num_done += 1
+        num_chapters_done += num_chapters
+        if error:
+            failed.append(book_id)
+            print("Book " + book_id + " failed: " + error)
+        minutes = max(time.time() - start_time, 1e-6) / 60
+        print("[{}/{}] book {}: {} chapters in {:.1f}s, {:.2f} books/min, "
+              "{:.2f} chapters/min, {} failed".format(
+                  num_done, len(todo), book_id, num_chapters, book_time,
+                  num_done / minutes, num_chapters_done / minutes, len(failed)))
+
+    workers = max(1, int(args.bookWorkers))
+    if workers == 1 or len(todo) < 2:
+        for book_id in todo:
+            report(process_and_summarize_book(book_id, args))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as executor:
+            futures = {executor.submit(process_and_summarize_book, book_id, args): book_id
+                       for book_id in todo}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception:
+                    # the worker process itself died, e.g. out of memory
+                    result = (futures[future], 0, 0.0, traceback.format_exc())
+                report(result)
+    return failed
+
+
+def create_parser():
+    """
+    Create the parser for the command line arguments of the book summarizer.
+    The summary service parses the features of each request with the same parser.
+
+    Returns:
+    argparse.ArgumentParser: the parser
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('-b', nargs=1, default="",
@@ -177,13 +588,24 @@ def main():
                         'in data/raw_books will be summarized')
     parser.add_argument(
         "-en", help="include an entity summary of each chapter", action="store_true")
+    parser.add_argument(
+        "-enFromChapters", help="with -en, find the book entities from the entities " \
+        "of each chapter, so that the book is only parsed once", action="store_true")
+    parser.add_argument(
+        "-nerBatchSize", help="the number of chunks of the book spaCy parses together " \
+        "when finding the book entities (default is 4)", type=int, default=4)
+    parser.add_argument(
+        "-nerProcesses", help="the number of processes spaCy uses when finding the " \
+        "book entities (default is 1)", type=int, default=1)
     parser.add_argument(
         "-ex", help="include an extractive summary of each chapter, " \
         "optionally choose how many sentences up to 9 (default is 1)", 
         nargs='?', const='1', default='0')
     parser.add_argument(
         "-exTechnique", help="choose the technique for extractive summarization by name," \
-        " options: luhn, lsa, lexrank, textrank, sumbasic, kl, reduction, random", nargs='?', const='luhn', default='luhn')
+        " options: luhn, lsa, lexrank, textrank, sumbasic, kl, reduction, random," \
+        " or several names separated by commas, or all, to include a quote from each" \
+        " technique (-ae uses the first technique)", nargs='?', const='luhn', default='luhn')
     parser.add_argument(
         "-ae", help="include an abstractive summary from an extractive summary" \
         " of each chapter", action="store_true")
@@ -191,39 +613,117 @@ def main():
         "-aa", help="include an abstractive summary from an abstractive summary" \
         " of each chapter, optionally choose short (s) or long (l) summary" \
         " (default is short)", nargs='?', const='s', default='n')
+    parser.add_argument(
+        "-abstrDebug", help="save the input and output of the abstractive summarizer " \
+        "in this directory", default=None)
+    parser.add_argument(
+        "-abstrBatchSize", help="the maximum number of segments summarized together " \
+        "by the abstractive summarizer (default is 8)", type=int, default=8)
+    parser.add_argument(
+        "-segmenter", help="how the sentences are found for the abstractive summarizer: " \
+        "model uses the spaCy model, sentencizer and rules do not need the model and " \
+        "are faster (default is model)", choices=SEGMENTERS, default='model')
+    parser.add_argument(
+        "-device", help="the device for the abstractive summarizer: cpu, cuda, or auto " \
+        "to use a GPU only if one is available (default is auto)", default='auto')
+    parser.add_argument(
+        "-threads", help="the number of CPU threads for the abstractive summarizer " \
+        "(default is the torch default)", type=int, default=0)
+    parser.add_argument(
+        "-interopThreads", help="the number of CPU threads between operations for the " \
+        "abstractive summarizer (default is the torch default)", type=int, default=0)
+    parser.add_argument(
+        "-quantize", help="use an int8 quantized abstractive summarizer model on the CPU",
+        action="store_true")
     parser.add_argument(
         "-fl", help="include the first lines of each chapter", action="store_true")
     parser.add_argument(
         "-analysis", help="analyze the summary", action="store_true")
+    parser.add_argument(
+        "-analyzeVariants", help="analyze all the existing summaries of the book, " \
+        "or of every book with a ground truth summary if -b is not used, created with " \
+        "any features, without creating a summary", action="store_true")
     parser.add_argument(
         "-w", help="write over the existing summary", action="store_true")
-    args = parser.parse_args()
+    parser.add_argument(
+        "-exportChapters", help="also save the chapter files in data/book_chapters",
+        action="store_true")
+    parser.add_argument(
+        "-noCache", help="do not use or save cached chapter results", action="store_true")
+    parser.add_argument(
+        "-cacheSize", help="the maximum size of the cache of chapter results in MB " \
+        "(default is 500)", type=int, default=500)
+    parser.add_argument(
+        "-workers", "--workers", help="summarize the chapters of a book in parallel " \
+        "using this many worker processes (default is 1)", type=int, default=1)
+    parser.add_argument(
+        "-profile", help="save the time of each stage of the summary, for the book and " \
+        "for each chapter, and the peak memory of the process in results/profiles", action="store_true")
+    parser.add_argument(
+        "-bookWorkers", help="when -b is not used, summarize this many books in " \
+        "parallel using worker processes (default is 1)", type=int, default=1)
+    return parser
+
+
+def check_args(args):
+    """
+    Check the values of the summary features in the arguments.
+
+    Parameters:
+    args: the command line arguments provided
+
+    Returns:
+    str: the error message, or an empty string if the arguments are valid
+    """
+    if args.ex not in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']:
+        return "For extractive summary, specify a number of sentences between 1 and 9"
+    techniques = get_techniques(args.exTechnique)
+    if (len(techniques) > 1) and any(technique not in TECHNIQUES for technique in techniques):
+        return "For extractive summary techniques, choose from " + ', '.join(TECHNIQUES) + \
+            " or all"
+    if args.aa not in ['l', 's', 'n']:
+        return "For abstractive from abstractive summary, specify l for long or s for short"
+    return ''
+
+
+def main():
+    """
+    Command line interface for the book summarizer
+
+    The user specifies which elements to include in the summary.
+    """
+    args = create_parser().parse_args()
     # if -b is not given, all raw books in raw_books folder will be summarized
     # otherwise argument following -b should be a string book_id,
     # where a book text file named book_id.txt is in the raw_books folder
-    if args.ex not in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']:
-        print("For extractive summary, specify a number of sentences between 1 and 9")
-        return
-    if args.aa not in ['l', 's', 'n']:
-        print("For abstractive from abstractive summary, specify l for long or s for short")
+    error = check_args(args)
+    if len(error) > 0:
+        print(error)
         return
     if not exists('../results'):
         makedirs('../results')
+    if args.analyzeVariants:
+        # only analyze the existing summaries, no summaries are created
+        if (args.b == ""):
+            book_ids = sorted(splitext(f)[0] for f in listdir('../data/summaries')
+                              if isfile(join('../data/summaries', f)))
+        else:
+            book_ids = [args.b[0]]
+        for book_id in book_ids:
+            num_summaries = analyze_summary_variants(book_id, args)
+            print("Book {}: {} summaries analyzed".format(book_id, num_summaries))
+        return
     if (args.b == ""):
-        book_files = [f for f in listdir(
-            '../data/raw_books') if isfile(join('../data/raw_books', f))]
-        for f in book_files:
-            book_id = (f.strip('.txt'))
-            # break down into chapters / segments, then summarize book
-            book_id, num_chapters = process_book(book_id)
-            if (book_id != ""):
-                summarize_book(book_id, num_chapters, args)
+        book_files = sorted(f for f in listdir(
+            '../data/raw_books') if isfile(join('../data/raw_books', f)))
+        book_ids = [splitext(f)[0] for f in book_files]
+        # break down into chapters / segments, then summarize each book
+        summarize_corpus(book_ids, args)
     else:
         book_id = args.b[0]
-        # break down into chapters / segments, then summarize book
-        book_id, num_chapters = process_book(book_id)
-        if (book_id != ""):
-            summarize_book(book_id, num_chapters, args)
+        # break down into chapters / segments, summarizing each chapter as it is reached
+        if isfile(get_data_filename(book_id, 'raw_books')):
+            summarize_book(book_id, stream_book(book_id, args.exportChapters), args)
 
 
 if __name__ == "__main__":
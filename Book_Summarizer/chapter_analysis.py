@@ -0,0 +1,93 @@
+"""
+This file has the chapter analysis shared by the summary features.
+Each chapter is read once and parsed once, whichever features are included in the summary.
+"""
+
+from sumy.parsers.plaintext import PlaintextParser
+from sumy.nlp.tokenizers import Tokenizer
+from data import get_data_filename, first_lines
+from nlp_models import load_nlp
+from artifact_cache import text_digest
+from extractive_summarizer import SentenceTermMatrix
+from profiler import span
+
+
+class ChapterAnalysis:
+    """
+    The text of a chapter and the results of parsing it.
+
+    The spaCy doc, the sumy document and the sentence term matrix are created the
+    first time they are used, so only the parsing needed by the chosen summary
+    features is done.
+    """
+
+    def __init__(self, book_id, chapter_num, lines=None):
+        """
+        Parameters:
+        book_id: (str) the book identifier
+        chapter_num: (int) the chapter number
+        lines: the lines of the chapter, read from the chapter file if not given
+        """
+        self.book_id = book_id
+        self.chapter_num = chapter_num
+        if lines is None:
+            filename = get_data_filename(book_id, 'book_chapters', chapter_num)
+            with span('read chapter'), open(filename, 'r') as chapter:
+                lines = chapter.readlines()
+        self.lines = lines
+        self.text = ''.join(lines)
+        self._doc = None
+        self._sumy_document = None
+        self._sentence_terms = None
+
+    @property
+    def digest(self):
+        """ The hash of the chapter text, used in the cache keys for the chapter results. """
+        return text_digest(self.text)
+
+    @property
+    def first_lines(self):
+        """ The first two non-empty lines of the chapter. """
+        return first_lines(self.lines)
+
+    @property
+    def doc(self):
+        """ The spaCy doc for the chapter, parsed with the full pipeline. """
+        if self._doc is None:
+            nlp = load_nlp()
+            with span('spacy parse'):
+                self._doc = nlp(' '.join(self.lines))
+        return self._doc
+
+    @property
+    def sentences(self):
+        """ The spaCy sentences of the chapter. """
+        return list(self.doc.sents)
+
+    @property
+    def tokens(self):
+        """ The token texts of the chapter. """
+        return [token.text for token in self.doc]
+
+    @property
+    def entities(self):
+        """ The named entities found in the chapter by spaCy. """
+        return self.doc.ents
+
+    @property
+    def sumy_document(self):
+        """ The sumy document for the chapter, used by the extractive summarizer. """
+        if self._sumy_document is None:
+            with span('sumy parse'):
+                parser = PlaintextParser(self.text, Tokenizer("english"))
+                self._sumy_document = parser.document
+        return self._sumy_document
+
+    @property
+    def sentence_terms(self):
+        """ The SentenceTermMatrix for the chapter, shared by the extractive summary techniques. """
+        if self._sentence_terms is None:
+            sumy_document = self.sumy_document
+            with span('sentence terms'):
+                self._sentence_terms = SentenceTermMatrix(sumy_document)
+        return self._sentence_terms
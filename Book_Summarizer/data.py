@@ -35,15 +35,22 @@ def get_data_filename(book_id, foldername, chapter_num=-1):
 
 
 def get_summary_extension(args):
-    """ Get the tags to include in the filename for the created summary. """
+    """
+    Get the tags to include in the filename for the created summary.
+    The entities found with -enFromChapters are not the same as with -en alone,
+    so they are tagged -enc instead of -en.
+    """
     ext = ''
+    entities_tag = '-enc' if (args.en and args.enFromChapters) else '-en'
     if args.fl and args.en and (args.ex != '0') and args.ae and (args.aa != 'n'):
         ext = '-all'
+        if args.enFromChapters:
+            ext = ext + entities_tag
     else:
         if args.fl:
             ext = ext + '-fl'
         if args.en:
-            ext = ext + '-en'
+            ext = ext + entities_tag
         if args.ex != '0':
             ext = ext + '-ex'
         if args.ae:
@@ -60,11 +67,26 @@ def get_results_filename(book_id, args):
     return '../results/summaries/' + book_id + get_summary_extension(args) + '.txt'
 
 
+def get_records_filename(book_id, args):
+    """ Get the filename for the JSON Lines records that the summary is created from. """
+    return '../results/summaries/' + book_id + get_summary_extension(args) + '.jsonl'
+
+
+def get_entities_filename(book_id):
+    """ Get the filename for the entities csv file of the book. """
+    return '../results/summaries/' + book_id + '.csv'
+
+
 def get_analysis_filename(book_id, args):
     """ Get the filename for the analysis csv file. """
     return '../results/analysis/' + book_id + get_summary_extension(args) + '.csv'
 
 
+def get_profile_filename(book_id, args, file_type):
+    """ Get the filename for the json or csv profile of the summary, file_type is json or csv. """
+    return '../results/profiles/' + book_id + get_summary_extension(args) + '.' + file_type
+
+
 def calculate_data_stats(book_filename, summary_filename):
     """
     Calculates statistics of the book and summary.
@@ -179,6 +201,178 @@ def save_summary(df_summaries, new_title, summary_filename):
         f.write(new_summary)
 
 
+class Chapter:
+    """
+    A chapter of a book, as divided from the raw book text.
+
+    The start and end are the byte offsets of the chapter in the raw book file.
+    """
+
+    def __init__(self, index, lines, start, end):
+        """
+        Parameters:
+        index: (int) the chapter number
+        lines: the lines of the chapter
+        start: the byte offset of the start of the chapter in the raw book file
+        end: the byte offset of the end of the chapter in the raw book file
+        """
+        self.index = index
+        self.lines = lines
+        self.start = start
+        self.end = end
+
+    @property
+    def text(self):
+        """ The text of the chapter. """
+        return ''.join(self.lines)
+
+
+def read_lines(filename, encoding='latin-1'):
+    """
+    Reads the lines of a book file with their byte offsets.
+    The file is read as latin-1, unless another encoding is given, and the line endings
+    are changed to newlines, as when the file is opened in text mode.
+
+    Parameters:
+    filename: the book file
+    encoding: the encoding of the book file
+
+    Returns:
+    iterator: the start offset, end offset and text of each line
+    """
+    offset = 0
+    with open(filename, 'rb') as book:
+        for raw_line in book:
+            line_start = 0
+            # a carriage return on its own also ends a line
+            cr = raw_line.find(b'\r')
+            while cr != -1 and raw_line[cr + 1:cr + 2] != b'\n':
+                yield offset + line_start, offset + cr + 1, \
+                    raw_line[line_start:cr].decode(encoding, 'replace') + '\n'
+                line_start = cr + 1
+                cr = raw_line.find(b'\r', line_start)
+            line = raw_line[line_start:].decode(encoding, 'replace')
+            if line.endswith('\r\n'):
+                line = line[:-2] + '\n'
+            yield offset + line_start, offset + len(raw_line), line
+            offset += len(raw_line)
+
+
+def clean_book_lines(lines):
+    """
+    Removes the Project Gutenberg license and book information where possible.
+    If the formatting of the book is not recognized, all the lines are kept.
+
+    Parameters:
+    lines: the lines of the raw book from read_lines
+
+    Returns:
+    iterator: the lines of the clean book, with their offsets
+    """
+    # lines are kept until the start of the book is found,
+    # in case the whole book needs to be used
+    pending = []
+    found = False
+    write_lines = False
+    for line in lines:
+        l = line[2]
+        if not found:
+            pending.append(line)
+        if (l[:12] == '*** START OF') or (l[:11] == '***START OF') or (l[:11] == '*END*THE SM'):
+            write_lines = True
+        elif (l[:10] == '*** END OF') or (l[:9] == '***END OF'):
+            write_lines = False
+        elif write_lines:
+            if not found:
+                found = True
+                pending = []
+            yield line
+    # if the formatting didn't match the above, just use the complete
+    # book with project gutenberg information
+    if not found:
+        for line in pending:
+            yield line
+
+
+def split_into_chapters(lines):
+    """
+    Divides the lines of a book into chapters, as each chapter is reached.
+    Assumes chapter breaks occur when there are two empty lines in a row
+    Makes chapters at least 20 lines long as there are often two double spaces 
+    at the start of a chapter
+    Limits chapters to the end of the next paragraph after 3000 lines
+
+    Parameters:
+    lines: the lines of the book, with their offsets
+
+    Returns:
+    iterator: the Chapter for each chapter, in order
+    """
+    count_chapters = 0
+    count_lines_in_chapter = 0
+    previous_blank_line = False
+    chapter_lines = []
+    start = end = 0
+    for line_start, line_end, l in lines:
+        if len(chapter_lines) == 0:
+            start = line_start
+        if (count_lines_in_chapter < 3000) and ((len(l) > 1) or (count_lines_in_chapter < 20)):
+            previous_blank_line = False
+            count_lines_in_chapter += 1
+            chapter_lines.append(l)
+        elif (len(l) == 1) and ((previous_blank_line == True) or (count_lines_in_chapter >= 3000)):
+            count_lines_in_chapter = 0
+            if len(chapter_lines) == 0:
+                end = start
+            yield Chapter(count_chapters, chapter_lines, start, end)
+            count_chapters += 1
+            chapter_lines = []
+            start = line_end
+            continue
+        elif (len(l) == 1):
+            count_lines_in_chapter += 1
+            previous_blank_line = True
+            chapter_lines.append(l)
+        else:
+            count_lines_in_chapter += 1
+            chapter_lines.append(l)
+        end = line_end
+    if len(chapter_lines) == 0:
+        end = start
+    yield Chapter(count_chapters, chapter_lines, start, end)
+
+
+def stream_book(book_id, export_chapters=False, encoding='latin-1'):
+    """
+    Reads the raw book once, saving the clean book and returning each chapter
+    as soon as it is divided from the book.
+
+    Parameters:
+    book_id: (str) the book identifier
+    export_chapters: also save the chapter files in the data/book_chapters folder
+    encoding: the encoding of the raw book file
+
+    Returns:
+    iterator: the Chapter for each chapter, in order
+    """
+    if not os.path.exists('../data/books'):
+        os.makedirs('../data/books')
+    if export_chapters and not os.path.exists('../data/book_chapters'):
+        os.makedirs('../data/book_chapters')
+    with open(get_data_filename(book_id, 'books'), 'w') as clean_book:
+        def save_lines(lines):
+            for line in lines:
+                clean_book.write(line[2])
+                yield line
+        lines = clean_book_lines(read_lines(
+            get_data_filename(book_id, 'raw_books'), encoding))
+        for chapter in split_into_chapters(save_lines(lines)):
+            if export_chapters:
+                save_chapter(get_data_filename(
+                    book_id, 'book_chapters', chapter.index), chapter.lines)
+            yield chapter
+
+
 def save_clean_book(pg_index):
     """
     Saves a clean version of the book to the ../data/books directory.
@@ -192,35 +386,17 @@ def save_clean_book(pg_index):
     """
     if not os.path.exists('../data/books'):
         os.makedirs('../data/books')
-    text_filename = get_text_filename(pg_index)
     book_filename = get_data_filename(pg_index, 'raw_books')
     clean_book_filename = get_data_filename(pg_index, 'books')
-    with open(book_filename, 'r', encoding='latin-1') as book:
-        with open(clean_book_filename, 'w') as clean_book:
-            write_lines = False
-            for l in book:
-                if (l[:12] == '*** START OF') or (l[:11] == '***START OF') or (l[:11] == '*END*THE SM'):
-                    write_lines = True
-                elif (l[:10] == '*** END OF') or (l[:9] == '***END OF'):
-                    write_lines = False
-                elif write_lines:
-                    clean_book.write(l)
-    # if the formatting didn't match the above, just use the complete
-    # book with project gutenberg information
-    if os.stat(clean_book_filename).st_size == 0:
-        with open(book_filename, 'r', encoding='latin-1') as book:
-            with open(clean_book_filename, 'w') as clean_book:
-                for l in book:
-                    clean_book.write(l)
+    with open(clean_book_filename, 'w') as clean_book:
+        for line_start, line_end, l in clean_book_lines(read_lines(book_filename)):
+            clean_book.write(l)
 
 
 def divide_book_into_chapters(book_id):
     """
     Divides the book file into separate chapter files.
-    Assumes chapter breaks occur when there are two empty lines in a row
-    Makes chapters at least 20 lines long as there are often two double spaces 
-    at the start of a chapter
-    Limits chapters to the end of the next paragraph after 3000 lines
+    The chapters are divided as in split_into_chapters.
 
     Parameters:
     book_id: (str) the book identifier
@@ -230,32 +406,10 @@ def divide_book_into_chapters(book_id):
     """
     if not os.path.exists('../data/book_chapters'):
         os.makedirs('../data/book_chapters')
-    book_filename = get_data_filename(book_id, 'books')
     count_chapters = 0
-    count_lines_in_chapter = 0
-    previous_blank_line = False
-    with open(book_filename, 'r', encoding='latin-1') as book:
-        lines = []
-        for l in book:
-            if (count_lines_in_chapter < 3000) and ((len(l) > 1) or (count_lines_in_chapter < 20)):
-                previous_blank_line = False
-                count_lines_in_chapter += 1
-                lines.append(l)
-            elif (len(l) == 1) and ((previous_blank_line == True) or (count_lines_in_chapter >= 3000)):
-                count_lines_in_chapter = 0
-                save_chapter(get_data_filename(
-                    book_id, 'book_chapters', count_chapters), lines)
-                count_chapters += 1
-                lines = []
-            elif (len(l) == 1):
-                count_lines_in_chapter += 1
-                previous_blank_line = True
-                lines.append(l)
-            else:
-                count_lines_in_chapter += 1
-                lines.append(l)
+    for chapter in split_into_chapters(read_lines(get_data_filename(book_id, 'books'))):
         save_chapter(get_data_filename(
-            book_id, 'book_chapters', count_chapters), lines)
+            book_id, 'book_chapters', chapter.index), chapter.lines)
         count_chapters += 1
     return count_chapters
 
@@ -316,6 +470,27 @@ def create_book_dataset():
     shutil.rmtree('tmp')
 
 
+def first_lines(lines):
+    """
+    Returns the first 2 non-empty lines from lines.
+
+    Parameters:
+    lines: the lines of a chapter
+
+    Returns:
+    the first two lines of the chapter followed by ... to indicate that the chapter continues
+    """
+    first = ''
+    num_lines = 0
+    for l in lines:
+        if len(l) > 1:
+            first = first + l.strip('\n') + ' '
+            num_lines += 1
+        if (num_lines >= 2):
+            break
+    return (first + '...\n')
+
+
 def first_lines_chapter(book_id, chapter_num):
     """ 
     Returns the first 2 lines of chapter chapter_num from book book_id. 
@@ -327,17 +502,8 @@ def first_lines_chapter(book_id, chapter_num):
     Returns:
     the first two lines of the chapter followed by ... to indicate that the chapter continues
     """
-    lines = ''
     with open(get_data_filename(book_id, 'book_chapters', chapter_num), 'r') as book_chapter:
-        num_lines = 0
-        if book_chapter.readable():
-            for l in book_chapter:
-                if len(l) > 1:
-                    lines = lines + l.strip('\n') + ' '
-                    num_lines += 1
-                if (num_lines >= 2):
-                    break
-    return (lines + '...\n')
+        return first_lines(book_chapter)
 
 
 def process_book(book_id):
@@ -355,8 +521,8 @@ def process_book(book_id):
     if not os.path.isfile(get_data_filename(book_id, 'raw_books')):
         book_id = ""
     if book_id != "":
-        save_clean_book(book_id)
-        num_chapters = divide_book_into_chapters(book_id)
+        for chapter in stream_book(book_id, export_chapters=True):
+            num_chapters += 1
     return book_id, num_chapters
 
 
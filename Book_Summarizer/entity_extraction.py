@@ -3,15 +3,19 @@ This file has the functions for the entity extracter.
 Create an entity summary from chapters of a large document.
 """
 
-from spacy import load
 from fuzzywuzzy import fuzz
 import operator
 import csv
 
-from data import get_data_filename
+from data import get_data_filename, get_entities_filename
+from nlp_models import load_nlp, get_other_pipes
 
 entity_types = ["PERSON", "NORP", "FAC", "ORG", "GPE", "LOC", "PRODUCT",
                 "EVENT", "WORK_OF_ART", "LAW", "LANGUAGE"]
+# the pipes needed to find entities, ner uses the token vectors of tok2vec
+NER_PIPES = ['tok2vec', 'ner']
+NER_BATCH_SIZE = 4
+CHUNK_SIZE = 100000
 
 
 def consolidate_list(long_list):
@@ -28,12 +32,14 @@ def consolidate_list(long_list):
         long_list.items(), key=operator.itemgetter(1), reverse=True)
     matched_list = dict()
     matched_list[sorted_long_list[0][0]] = sorted_long_list[0][1]
+    matched_index = EntityIndex(matched_list.keys())
     for new_item in sorted_long_list[1:]:
-        match_found = find_matching_item(matched_list.keys(), new_item[0])
+        match_found = matched_index.find(new_item[0])
         if len(match_found) > 0:
             matched_list[match_found] = matched_list[match_found] + new_item[1]
         else:
             matched_list[new_item[0]] = new_item[1]
+            matched_index.add(new_item[0])
     return matched_list
 
 
@@ -56,6 +62,78 @@ def find_matching_item(item_list, new_item):
     return match_found
 
 
+class EntityIndex:
+    """
+    An index of items for finding the same match as find_matching_item,
+    without comparing the new item to every item in the list.
+
+    Two strings can only have a partial_ratio above 80 if they share a pair of
+    adjacent characters, when the shorter string has at least 5 characters.
+    So the new item is only compared to the items that share a pair of characters with it,
+    and to the short items. As in find_matching_item, the last matching item is returned,
+    so the candidates are compared from the last item and the first match is returned.
+    An exact match is always a match, so only the items after it need to be compared.
+    The match for each new item is remembered until another item is added.
+    """
+
+    def __init__(self, item_list=()):
+        """
+        Parameters:
+        item_list: the items, in the order find_matching_item would compare them
+        """
+        self.items = []
+        self.positions = dict()
+        self.bigrams = dict()
+        self.short_items = []
+        self.matches = dict()
+        for item in item_list:
+            self.add(item)
+
+    def add(self, item):
+        """ Add an item to the end of the index. """
+        position = len(self.items)
+        self.items.append(item)
+        self.positions[item] = position
+        if len(item) < 5:
+            self.short_items.append(position)
+        for bigram in set(get_bigrams(item)):
+            self.bigrams.setdefault(bigram, []).append(position)
+        self.matches.clear()
+
+    def find(self, new_item):
+        """
+        Find the matching item, as find_matching_item(item_list, new_item) does.
+
+        Parameters:
+        new_item: a potential new item to add to the list
+
+        Returns:
+        str: the last item in the index that matches new_item, or '' if none match
+        """
+        if new_item in self.matches:
+            return self.matches[new_item]
+        exact = self.positions.get(new_item, -1)
+        if len(new_item) < 5:
+            candidates = range(exact + 1, len(self.items))
+        else:
+            candidates = set(self.short_items)
+            for bigram in set(get_bigrams(new_item)):
+                candidates.update(self.bigrams.get(bigram, []))
+            candidates = [position for position in candidates if position > exact]
+        match_found = self.items[exact] if exact >= 0 else ''
+        for position in sorted(candidates, reverse=True):
+            if fuzz.partial_ratio(self.items[position], new_item) > 80:
+                match_found = self.items[position]
+                break
+        self.matches[new_item] = match_found
+        return match_found
+
+
+def get_bigrams(text):
+    """ Get the pairs of adjacent characters in text. """
+    return [text[i:i + 2] for i in range(len(text) - 1)]
+
+
 def remove_characters_from_entities(characters, entities):
     """
     Consolidate character and entities found by removing characters from entities.
@@ -74,60 +152,140 @@ def remove_characters_from_entities(characters, entities):
     return characters, entities
 
 
-def find_entities_book(book_id):
+def get_book_chunks(book_id, chunk_size=CHUNK_SIZE):
     """
-    Use spacy to find the entities in the book.
-
-    Separates entities found by spacy into characters and key words.
-    Performs some formatting on the entities found to remove returns and whitespace.
-    Consolidates lists so that similar entities are joined into one entity.
+    Divide the book into chunks of text for spacy, ending each chunk at a paragraph break.
 
     Parameters:
     book_id: (str) the book identifier
+    chunk_size: the number of characters after which the chunk ends at the next
+    paragraph break, or at the next line after twice this many characters
 
     Returns:
-    list: characters
-    list: key words
+    iterator: the text of each chunk, in order
     """
     filename = get_data_filename(book_id, 'books')
-    try:
-        nlp = load('en_core_web_lg')
-    except:
-        nlp = load('en_core_web_sm')
     with open(filename, 'r') as book:
-        book_text = ' '.join(book)
-        if len(book_text) > 1000000:
-            book_text = book_text[:1000000]
-        doc = nlp(book_text)
-    characters = dict()
-    key_entities = dict()
-    for ent in doc.ents:
-        new_entity = ent.text.replace('\n', '')
+        lines = []
+        size = 0
+        for l in book:
+            lines.append(l)
+            size += len(l)
+            if (size >= chunk_size) and ((len(l) == 1) or (size >= 2 * chunk_size)):
+                yield ' '.join(lines)
+                lines = []
+                size = 0
+        if len(lines) > 0:
+            yield ' '.join(lines)
+
+
+def get_text_label(ent):
+    """ Get the text and label of a spaCy entity, or of an entity saved as a (text, label) pair. """
+    if isinstance(ent, (tuple, list)):
+        return ent[0], ent[1]
+    return ent.text, ent.label_
+
+
+def count_entities(ents, characters, key_entities):
+    """
+    Count the characters and key words in entities found by spacy.
+    Performs some formatting on the entities found to remove returns and whitespace.
+
+    Parameters:
+    ents: the spaCy entities, or (text, label) pairs from get_text_label
+    characters: the counts of the characters found so far, updated
+    key_entities: the counts of the key words found so far, updated
+    """
+    for ent in ents:
+        text, label = get_text_label(ent)
+        new_entity = text.replace('\n', '')
         new_entity = new_entity.strip()
         if len(new_entity) > 0:
-            if (ent.label_ in entity_types):
+            if (label in entity_types):
                 if (new_entity in key_entities):
                     key_entities[new_entity] = key_entities[new_entity] + 1
                 else:
                     key_entities[new_entity] = 1
-            if (ent.label_ == "PERSON"):
+            if (label == "PERSON"):
                 if new_entity in characters:
                     characters[new_entity] = characters[new_entity] + 1
                 else:
                     characters[new_entity] = 1
+
+
+def consolidate_entities(characters, key_entities):
+    """
+    Consolidates lists so that similar entities are joined into one entity.
+
+    Parameters:
+    characters: the counts of the characters found
+    key_entities: the counts of the key words found
+
+    Returns:
+    list: characters
+    list: key words
+    """
     matched_entities = consolidate_list(key_entities)
     matched_characters = dict()
+    entity_index = EntityIndex(matched_entities.keys())
     for character in characters.keys():
-        matched_character = find_matching_item(
-            matched_entities.keys(), character)
+        matched_character = entity_index.find(character)
         if matched_character in matched_characters:
             matched_characters[matched_character] = matched_characters[matched_character] + \
                 characters[character]
         elif len(matched_character) > 0:
             matched_characters[matched_character] = characters[character]
-    matched_characters, matched_entities = remove_characters_from_entities(
-        matched_characters, matched_entities)
-    return matched_characters, matched_entities
+    return remove_characters_from_entities(matched_characters, matched_entities)
+
+
+def find_entities_book(book_id, batch_size=NER_BATCH_SIZE, n_process=1):
+    """
+    Use spacy to find the entities in the book.
+
+    The book is parsed in chunks with only the entity recognizer,
+    so the whole book is covered however long it is.
+    Separates entities found by spacy into characters and key words.
+    Performs some formatting on the entities found to remove returns and whitespace.
+    Consolidates lists so that similar entities are joined into one entity.
+
+    Parameters:
+    book_id: (str) the book identifier
+    batch_size: the number of chunks spacy parses together
+    n_process: the number of processes spacy uses to parse the chunks
+
+    Returns:
+    list: characters
+    list: key words
+    """
+    nlp = load_nlp()
+    characters = dict()
+    key_entities = dict()
+    for doc in nlp.pipe(get_book_chunks(book_id), batch_size=batch_size, n_process=n_process,
+                        disable=get_other_pipes(nlp, NER_PIPES)):
+        count_entities(doc.ents, characters, key_entities)
+    return consolidate_entities(characters, key_entities)
+
+
+def find_entities_book_from_chapters(chapters_ents):
+    """
+    Find the entities in the book from the entities already found in each chapter,
+    so that the book does not need to be parsed again.
+
+    Separates entities into characters and key words.
+    Consolidates lists so that similar entities are joined into one entity.
+
+    Parameters:
+    chapters_ents: for each chapter, the (text, label) pairs of the entities found
+
+    Returns:
+    list: characters
+    list: key words
+    """
+    characters = dict()
+    key_entities = dict()
+    for chapter_ents in chapters_ents:
+        count_entities(chapter_ents, characters, key_entities)
+    return consolidate_entities(characters, key_entities)
 
 
 def find_entities_chapter(book_id, chapter, book_characters, book_entities):
@@ -145,19 +303,34 @@ def find_entities_chapter(book_id, chapter, book_characters, book_entities):
     list: key words
     """
     filename = get_data_filename(book_id, 'book_chapters', chapter)
-    try:
-        nlp = load('en_core_web_lg')
-    except:
-        nlp = load('en_core_web_sm')
+    nlp = load_nlp()
     with open(filename, 'r') as chapter:
         chapter_text = ' '.join(chapter)
         doc = nlp(chapter_text)
+    return match_entities_chapter(doc.ents, book_characters, book_entities)
+
+
+def match_entities_chapter(chapter_ents, book_characters, book_entities):
+    """
+    Count the entities found in a chapter, matching the entities to the book entities.
+
+    Parameters:
+    chapter_ents: the spaCy entities found in the chapter, or their (text, label) pairs
+    book_characters: the characters that were found in the whole book
+    book_entities: the key words that were found in the whole book
+
+    Returns:
+    list: characters
+    list: key words
+    """
     characters = dict()
     key_entities = dict()
-    for ent in doc.ents:
-        matched_entity = find_matching_item(book_entities.keys(), ent.text)
-        matched_character = find_matching_item(
-            book_characters.keys(), ent.text)
+    entity_index = EntityIndex(book_entities.keys())
+    character_index = EntityIndex(book_characters.keys())
+    for ent in chapter_ents:
+        text, label = get_text_label(ent)
+        matched_entity = entity_index.find(text)
+        matched_character = character_index.find(text)
         if (len(matched_entity) > 0):
             if (matched_entity in key_entities):
                 key_entities[matched_entity] = key_entities[matched_entity] + 1
@@ -196,41 +369,26 @@ def create_sentence(entities, about_book=True, about_characters=True):
     return sentence
 
 
-def save_sorted_entities_book(characters, entities, book_id):
-    """
-    Saves the book entities in a csv file, begins the file.
-
-    Parameters:
-    characters: list of the characters in the book
-    entities: list of the key words in the book
-    book_id: (str) the book identifier
-    """
-    sorted_characters = sorted(
-        characters.items(), key=operator.itemgetter(1), reverse=True)
-    sorted_entities = sorted(
-        entities.items(), key=operator.itemgetter(1), reverse=True)
-    with open('../results/summaries/' + book_id + '.csv', 'w') as csvFile:
-        writer = csv.writer(csvFile)
-        writer.writerows(sorted_characters)
-        writer.writerows(sorted_entities)
+def sort_entities(entities):
+    """ Sort the entities from the most to the least frequent. """
+    return sorted(entities.items(), key=operator.itemgetter(1), reverse=True)
 
 
-def save_sorted_entities_chapter(characters, entities, book_id, chapter):
+def save_sorted_entities(book_id, characters, entities, chapters):
     """
-    Saves the chapter entities in a csv file, appends to the existing file.
+    Saves the book entities and the entities of each chapter in a csv file.
 
     Parameters:
-    characters: list of the characters in the chapter
-    entities: list of the key words in the chapter
     book_id: (str) the book identifier
-    chapter: (int) the chapter number
+    characters: the characters in the book
+    entities: the key words in the book
+    chapters: the characters and key words of each chapter
     """
-    sorted_characters = sorted(
-        characters.items(), key=operator.itemgetter(1), reverse=True)
-    sorted_entities = sorted(
-        entities.items(), key=operator.itemgetter(1), reverse=True)
-    with open('../results/summaries/' + book_id + '.csv', 'a') as csvFile:
+    with open(get_entities_filename(book_id), 'w') as csvFile:
         writer = csv.writer(csvFile)
-        writer.writerows([['Chapter ' + str(chapter)]])
-        writer.writerows(sorted_characters)
-        writer.writerows(sorted_entities)
+        writer.writerows(sort_entities(characters))
+        writer.writerows(sort_entities(entities))
+        for chapter, (chapter_characters, chapter_entities) in enumerate(chapters):
+            writer.writerows([['Chapter ' + str(chapter)]])
+            writer.writerows(sort_entities(chapter_characters))
+            writer.writerows(sort_entities(chapter_entities))
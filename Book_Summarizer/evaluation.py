@@ -0,0 +1,357 @@
+"""
+This file has the corpus evaluation of the book summarizer.
+Every summary in results/summaries is compared with the ground truth summary of its
+book in data/summaries, with ROUGE-1, ROUGE-2 and ROUGE-L, the cosine similarity of the
+TF-IDF vectors and the cosine similarity of the spaCy doc vectors.
+The similarities are computed for all the summaries together as matrix operations.
+"""
+
+from artifact_cache import ArtifactCache
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from os import listdir, makedirs
+from os.path import dirname, exists, isfile, join, splitext
+from scipy import sparse
+import numpy as np
+import argparse
+import csv
+import re
+import time
+
+WORD_REGEX = re.compile(r"[a-z0-9]+")
+ROUGE_MEASURES = ['rouge-1', 'rouge-2', 'rouge-l']
+MEASURES = [measure + '-' + score for measure in ROUGE_MEASURES for score in ['p', 'r', 'f']] + \
+    ['tfidf cosine', 'embedding cosine']
+
+
+def tokenize(text):
+    """
+    Get the words of a text for ROUGE and TF-IDF, in lower case without punctuation.
+
+    Parameters:
+    text: the text
+
+    Returns:
+    list: the words
+    """
+    return WORD_REGEX.findall(text.lower())
+
+
+def get_scores(overlap, num_reference, num_summary):
+    """
+    Get the precision, recall and F1 score from the number of matching units.
+
+    Parameters:
+    overlap: the number of units in both the summary and the reference
+    num_reference: the number of units in the reference summary
+    num_summary: the number of units in the created summary
+
+    Returns:
+    list: the precision, recall and F1 score
+    """
+    precision = overlap / num_summary if num_summary > 0 else 0.0
+    recall = overlap / num_reference if num_reference > 0 else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    return [precision, recall, f1]
+
+
+def rouge_n(reference_words, summary_words, n):
+    """
+    Calculate ROUGE-N, the overlap of the n-grams of the summary and the reference.
+
+    Parameters:
+    reference_words: the words of the reference summary
+    summary_words: the words of the created summary
+    n: the length of the n-grams
+
+    Returns:
+    list: the precision, recall and F1 score
+    """
+    reference_ngrams = Counter(zip(*[reference_words[i:] for i in range(n)]))
+    summary_ngrams = Counter(zip(*[summary_words[i:] for i in range(n)]))
+    overlap = sum((reference_ngrams & summary_ngrams).values())
+    return get_scores(overlap, sum(reference_ngrams.values()), sum(summary_ngrams.values()))
+
+
+def lcs_length(reference_words, summary_words):
+    """
+    Get the length of the longest common subsequence of two lists of words.
+    The subsequence is found with a bit vector over the reference words, so each word
+    of the summary takes a few integer operations rather than a pass over the reference.
+
+    Parameters:
+    reference_words: the words of the reference summary
+    summary_words: the words of the created summary
+
+    Returns:
+    int: the length of the longest common subsequence
+    """
+    # the positions of each word in the reference, as the bits of an integer
+    positions = dict()
+    for i, word in enumerate(reference_words):
+        positions[word] = positions.get(word, 0) | (1 << i)
+    all_bits = (1 << len(reference_words)) - 1
+    bits = all_bits
+    for word in summary_words:
+        matches = bits & positions.get(word, 0)
+        bits = ((bits + matches) | (bits - matches)) & all_bits
+    # each bit that is no longer set is a word of the subsequence
+    return len(reference_words) - bin(bits).count('1')
+
+
+def rouge_l(reference_words, summary_words):
+    """
+    Calculate ROUGE-L, from the longest common subsequence of the words of the whole
+    summary and the whole reference.
+
+    Parameters:
+    reference_words: the words of the reference summary
+    summary_words: the words of the created summary
+
+    Returns:
+    list: the precision, recall and F1 score
+    """
+    return get_scores(lcs_length(reference_words, summary_words),
+                      len(reference_words), len(summary_words))
+
+
+def score_rouge(words):
+    """
+    Calculate ROUGE-1, ROUGE-2 and ROUGE-L for a summary, which can run in a worker process.
+
+    Parameters:
+    words: the words of the reference summary and the words of the created summary
+
+    Returns:
+    list: the precision, recall and F1 score of each measure
+    """
+    reference_words, summary_words = words
+    return rouge_n(reference_words, summary_words, 1) + \
+        rouge_n(reference_words, summary_words, 2) + \
+        rouge_l(reference_words, summary_words)
+
+
+def tfidf_cosine(reference_words, summary_words, references):
+    """
+    Calculate the cosine similarity of the TF-IDF vectors of each summary and its reference.
+    The document frequencies are counted over all the references and summaries.
+
+    Parameters:
+    reference_words: the words of each reference summary
+    summary_words: the words of each created summary
+    references: the index in reference_words of the reference for each summary
+
+    Returns:
+    numpy.ndarray: the cosine similarity for each summary
+    """
+    documents = reference_words + summary_words
+    vocabulary = dict()
+    rows, columns, counts = [], [], []
+    for row, words in enumerate(documents):
+        for word, count in Counter(words).items():
+            rows.append(row)
+            columns.append(vocabulary.setdefault(word, len(vocabulary)))
+            counts.append(count)
+    matrix = sparse.csr_matrix((np.array(counts, dtype=np.float64), (rows, columns)),
+                               shape=(len(documents), max(len(vocabulary), 1)))
+    document_frequency = np.bincount(columns, minlength=matrix.shape[1])
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    matrix = matrix.multiply(idf).tocsr()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    matrix = sparse.diags(1 / np.where(norms > 0, norms, 1)) @ matrix
+    summary_matrix = matrix[len(reference_words):]
+    reference_matrix = matrix[np.asarray(references, dtype=np.int64)]
+    return np.asarray(summary_matrix.multiply(reference_matrix).sum(axis=1)).ravel()
+
+
+def embedding_cosine(reference_vectors, summary_vectors):
+    """
+    Calculate the cosine similarity of the spaCy doc vectors of each summary and its reference.
+
+    Parameters:
+    reference_vectors: the doc vector of the reference for each summary
+    summary_vectors: the doc vector of each summary
+
+    Returns:
+    numpy.ndarray: the cosine similarity for each summary, 0 if a vector is empty
+    """
+    reference_matrix = np.array(reference_vectors, dtype=np.float32)
+    summary_matrix = np.array(summary_vectors, dtype=np.float32)
+    dots = np.einsum('ij,ij->i', reference_matrix, summary_matrix)
+    norms = np.linalg.norm(reference_matrix, axis=1) * np.linalg.norm(summary_matrix, axis=1)
+    return np.where(norms > 0, dots / np.where(norms > 0, norms, 1), 0.0)
+
+
+def find_summaries(summaries_dir='../results/summaries', references_dir='../data/summaries'):
+    """
+    Find the created summaries that have a ground truth summary.
+
+    Parameters:
+    summaries_dir: the directory of the created summaries
+    references_dir: the directory of the ground truth summaries
+
+    Returns:
+    list: the name of each summary, such as 11-fl-en, and the identifier of its book
+    """
+    book_ids = set(splitext(f)[0] for f in listdir(references_dir)
+                   if isfile(join(references_dir, f)))
+    summaries = []
+    for f in sorted(listdir(summaries_dir)):
+        if not f.endswith('.txt'):
+            continue
+        name = splitext(f)[0]
+        # the longest book identifier that the name starts with, as identifiers can have -
+        parts = name.split('-')
+        for end in range(len(parts), 0, -1):
+            if '-'.join(parts[:end]) in book_ids:
+                summaries.append((name, '-'.join(parts[:end])))
+                break
+    return summaries
+
+
+def read_words(filename):
+    """ Read a summary and get its words. """
+    with open(filename, 'r') as summary_file:
+        return tokenize(summary_file.read())
+
+
+def get_doc_vectors(filenames, cache):
+    """
+    Get the spaCy doc vector of each summary, from the cache of the summary analysis.
+
+    Parameters:
+    filenames: the filenames of the summaries
+    cache: the ArtifactCache for the vectors
+
+    Returns:
+    list: the doc vector of each summary, or None if the spaCy model is not available
+    """
+    # spaCy is only imported when the doc vectors are needed
+    from summary_vectors import load_summary
+    vectors = []
+    for filename in filenames:
+        vector = load_summary(filename, cache)['vector']
+        if vector is None:
+            return None
+        vectors.append(vector)
+    return vectors
+
+
+def evaluate_corpus(args):
+    """
+    Compare every created summary with the ground truth summary of its book.
+
+    Parameters:
+    args: the command line arguments provided
+
+    Returns:
+    list: for each summary, the name of the summary, the book identifier, the features
+    it was created with and the value of each measure in MEASURES
+    """
+    summaries = find_summaries()
+    book_ids = sorted(set(book_id for name, book_id in summaries))
+    references = {book_id: i for i, book_id in enumerate(book_ids)}
+    # each ground truth summary is read once, for all the summaries of its book
+    reference_words = [read_words(join('../data/summaries', book_id + '.txt'))
+                       for book_id in book_ids]
+    summary_words = [read_words(join('../results/summaries', name + '.txt'))
+                     for name, book_id in summaries]
+    summary_references = [references[book_id] for name, book_id in summaries]
+    pairs = [(reference_words[reference], words)
+             for reference, words in zip(summary_references, summary_words)]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            rouge_scores = list(executor.map(score_rouge, pairs, chunksize=16))
+    else:
+        rouge_scores = list(map(score_rouge, pairs))
+    tfidf_scores = tfidf_cosine(reference_words, summary_words, summary_references)
+    embedding_scores = None
+    if not args.noEmbeddings and len(summaries) > 0:
+        cache = ArtifactCache(None if args.noCache else '../results/cache',
+                              args.cacheSize * 1024 * 1024)
+        reference_vectors = get_doc_vectors(
+            [join('../data/summaries', book_id + '.txt') for book_id in book_ids], cache)
+        summary_vectors = get_doc_vectors(
+            [join('../results/summaries', name + '.txt') for name, book_id in summaries], cache)
+        if reference_vectors is not None and summary_vectors is not None:
+            embedding_scores = embedding_cosine(
+                [reference_vectors[reference] for reference in summary_references],
+                summary_vectors)
+    rows = []
+    for i, (name, book_id) in enumerate(summaries):
+        features = name[len(book_id) + 1:]
+        embedding = '' if embedding_scores is None else float(embedding_scores[i])
+        rows.append([name, book_id, features] + rouge_scores[i] +
+                    [float(tfidf_scores[i]), embedding])
+    return rows
+
+
+def aggregate_scores(rows):
+    """
+    Get the mean of each measure for each set of features, over all the books.
+
+    Parameters:
+    rows: the rows from evaluate_corpus
+
+    Returns:
+    list: for each set of features, the features, the number of summaries and the mean
+    of each measure in MEASURES
+    """
+    groups = dict()
+    for row in rows:
+        groups.setdefault(row[2], []).append(row[3:])
+    table = []
+    for features, scores in sorted(groups.items()):
+        means = []
+        for column in zip(*scores):
+            values = [value for value in column if value != '']
+            means.append(sum(values) / len(values) if len(values) > 0 else '')
+        table.append([features, len(scores)] + means)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare every summary in results/summaries with the ground truth '
+        'summary of its book in data/summaries')
+    parser.add_argument(
+        "-o", "--output", help="the csv file for the scores of each summary, the mean " \
+        "scores for each set of features are saved with -mean added to the name " \
+        "(default is results/analysis/evaluation.csv)",
+        default='../results/analysis/evaluation.csv')
+    parser.add_argument(
+        "-workers", help="calculate ROUGE using this many worker processes (default is 1)",
+        type=int, default=1)
+    parser.add_argument(
+        "-noEmbeddings", help="do not calculate the spaCy doc vector cosine similarity, " \
+        "so the spaCy model is not loaded", action="store_true")
+    parser.add_argument(
+        "-noCache", help="do not use or save the cached doc vectors of the summaries",
+        action="store_true")
+    parser.add_argument(
+        "-cacheSize", help="the maximum size of the cache in MB (default is 500)",
+        type=int, default=500)
+    args = parser.parse_args()
+    if not exists('../results/summaries') or not exists('../data/summaries'):
+        print("Create summaries in results/summaries and download the ground truth " \
+              "summaries to data/summaries first")
+        return
+    start_time = time.time()
+    rows = evaluate_corpus(args)
+    output_dir = dirname(args.output)
+    if len(output_dir) > 0 and not exists(output_dir):
+        makedirs(output_dir)
+    with open(args.output, 'w') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(['summary', 'book', 'features'] + MEASURES)
+        writer.writerows(rows)
+    with open(splitext(args.output)[0] + '-mean.csv', 'w') as csvFile:
+        writer = csv.writer(csvFile)
+        writer.writerow(['features', 'summaries'] + MEASURES)
+        writer.writerows(aggregate_scores(rows))
+    print("{} summaries of {} books evaluated in {:.1f}s".format(
+        len(rows), len(set(row[1] for row in rows)), time.time() - start_time))
+
+
+if __name__ == "__main__":
+    main()
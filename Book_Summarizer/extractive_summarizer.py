@@ -13,10 +13,339 @@ from sumy.summarizers.kl import KLSummarizer
 from sumy.summarizers.random import RandomSummarizer
 from sumy.summarizers.reduction import ReductionSummarizer
 from sumy.summarizers.sum_basic import SumBasicSummarizer
+from sumy.utils import ItemsCount
+from scipy import sparse
+import numpy as np
+import random
+
 from data import get_data_filename
 
+# the version of the quotes found by the techniques, part of the cache key of a quote,
+# increase it when a change to a technique can change the sentences chosen
+QUOTE_VERSION = 2
+TECHNIQUES = ['luhn', 'lsa', 'lexrank', 'textrank', 'sumbasic', 'kl', 'reduction', 'random']
+
+SUMY_SUMMARIZERS = {'luhn': LuhnSummarizer, 'lsa': LsaSummarizer,
+                    'lexrank': LexRankSummarizer, 'textrank': TextRankSummarizer,
+                    'sumbasic': SumBasicSummarizer, 'kl': KLSummarizer,
+                    'reduction': ReductionSummarizer, 'random': RandomSummarizer}
+
+
+class SentenceTermMatrix:
+    """
+    The sentences of a chapter and the counts of each term in each sentence,
+    built once per chapter and shared by all the extractive summarization techniques.
+
+    Each technique is a port of the sumy summarizer of the same name, with the
+    default null stemmer and no stop words, to sparse matrix operations.
+    The sentences chosen are the same as with the sumy summarizers, except where
+    floating point rounding changes the order of sentences with equal ratings.
+    As in sumy, sentences with the same text share one rating, except for luhn and lsa.
+    """
+
+    def __init__(self, document):
+        """
+        Parameters:
+        document: the sumy document for the chapter
+        """
+        self.sentences = document.sentences
+        self.terms = dict()
+        # the terms are the lower case words, the words of the headings are only
+        # used by luhn and lsa, which use all the words of the document
+        self.sentence_terms = []
+        self.raw_terms = []
+        self.raw_lengths = []
+        for sentence in self.sentences:
+            words = sentence.words
+            self.sentence_terms.append(np.array(
+                [self.get_term(word.lower()) for word in words], dtype=np.int64))
+            self.raw_lengths.append(len(words))
+        # in kl, the words of the summary are not lower case, so only the words
+        # that are already lower case are counted as terms
+        for sentence in self.sentences:
+            self.raw_terms.append(np.array(
+                [self.terms[word] for word in sentence.words if word in self.terms],
+                dtype=np.int64))
+        self.document_terms = np.array(
+            [self.get_term(word.lower()) for word in document.words], dtype=np.int64)
+        num_sentences = len(self.sentences)
+        num_terms = len(self.terms)
+        self.counts = self.create_matrix(self.sentence_terms, num_sentences, num_terms)
+        self.lengths = np.array([len(terms) for terms in self.sentence_terms], dtype=np.float64)
+        self.raw_lengths = np.array(self.raw_lengths, dtype=np.float64)
+        # sentences with the same text are the same key in the sumy ratings
+        keys = dict()
+        self.groups = np.array([keys.setdefault((sentence.is_heading, str(sentence)), len(keys))
+                                for sentence in self.sentences], dtype=np.int64)
+        self.num_groups = len(keys)
+        last = np.zeros(self.num_groups, dtype=np.int64)
+        last[self.groups] = np.arange(num_sentences)
+        self.last_in_group = last[self.groups]
+
+    def get_term(self, term):
+        """ Get the column of the term, adding the term if it is new. """
+        return self.terms.setdefault(term, len(self.terms))
+
+    @staticmethod
+    def create_matrix(sentence_terms, num_sentences, num_terms):
+        """ Create the sparse sentences x terms matrix of counts. """
+        rows = np.repeat(np.arange(num_sentences), [len(terms) for terms in sentence_terms])
+        cols = np.concatenate(sentence_terms) if num_sentences > 0 else np.zeros(0, dtype=np.int64)
+        matrix = sparse.csr_matrix((np.ones(len(cols)), (rows, cols)),
+                                   shape=(num_sentences, num_terms))
+        matrix.sum_duplicates()
+        return matrix
+
+    def summarize(self, technique, num_sentences):
+        """
+        Extract the best sentences with the technique.
+
+        Parameters:
+        technique: the name of the extractive summarization technique,
+        luhn is used if the name is not known
+        num_sentences: how many sentences to extract
+
+        Returns:
+        tuple: the extracted sumy sentences, in document order
+        """
+        if technique not in TECHNIQUES:
+            technique = 'luhn'
+        if len(self.sentences) == 0:
+            return ()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratings = getattr(self, 'rate_' + technique)()
+        if ratings is None:
+            return ()
+        return self.get_best_sentences(ratings, num_sentences)
+
+    def get_best_sentences(self, ratings, count):
+        """ The sentences with the highest ratings, in document order, as in sumy. """
+        order = list(np.argsort(-np.asarray(ratings, dtype=np.float64), kind='stable'))
+        best = sorted(ItemsCount(count)(order))
+        return tuple(self.sentences[i] for i in best)
+
+    def by_sentence(self, group_ratings):
+        """ Get the rating of each sentence from the rating of its text. """
+        return np.asarray(group_ratings)[self.groups]
+
+    def rate_luhn(self):
+        """ Luhn: the best chunk of significant words in each sentence. """
+        significant = np.bincount(self.document_terms, minlength=len(self.terms)) > 1
+        ratings = np.zeros(len(self.sentences))
+        for i, terms in enumerate(self.sentence_terms):
+            ratings[i] = self.rate_luhn_sentence(significant[terms])
+        return ratings
+
+    @staticmethod
+    def rate_luhn_sentence(is_significant, max_gap_size=4):
+        """ The rating of the best chunk of significant words, as in LuhnSummarizer. """
+        best = 0
+        chunk_start = -1
+        last_significant = -1
+        num_significant = 0
+        for order, significant in enumerate(is_significant):
+            if significant:
+                if chunk_start < 0:
+                    chunk_start = order
+                    num_significant = 0
+                last_significant = order
+                num_significant += 1
+            elif chunk_start >= 0 and order - last_significant >= max_gap_size:
+                # end of chunk
+                if num_significant > 1:
+                    best = max(best, num_significant**2 / (last_significant - chunk_start + 1))
+                chunk_start = -1
+        if chunk_start >= 0 and num_significant > 1:
+            best = max(best, num_significant**2 / (last_significant - chunk_start + 1))
+        return best
+
+    def rate_lsa(self, smooth=0.4):
+        """
+        LSA: all the dimensions of the singular value decomposition are used, so the rank
+        of each sentence is the length of its column of the smoothed term frequency matrix.
+        """
+        num_words = len(np.unique(self.document_terms))
+        if num_words == 0:
+            return None
+        counts = self.counts
+        max_counts = counts.max(axis=1).toarray().ravel()
+        nonzero = np.diff(counts.indptr)
+        rows = np.repeat(np.arange(len(self.sentences)), nonzero)
+        values = smooth + (1.0 - smooth) * counts.data / max_counts[rows]
+        ranks = (num_words - nonzero) * smooth**2 + \
+            np.bincount(rows, weights=values**2, minlength=len(self.sentences))
+        ranks[max_counts == 0] = 0.0
+        return np.sqrt(ranks)
+
+    def rate_lexrank(self, threshold=0.1, epsilon=0.1):
+        """ LexRank: the power method on the graph of idf modified cosine similarities. """
+        num_sentences = len(self.sentences)
+        counts = self.counts
+        max_counts = counts.max(axis=1).toarray().ravel()
+        max_counts[max_counts == 0] = 1
+        sentence_frequencies = np.bincount(counts.indices, minlength=len(self.terms))
+        idf = np.log(num_sentences / (1.0 + sentence_frequencies))
+        tf_idf = sparse.diags(1.0 / max_counts) @ counts @ sparse.diags(idf)
+        tf_idf = sparse.csr_matrix(tf_idf)
+        norms = np.sqrt(np.asarray(tf_idf.multiply(tf_idf).sum(axis=1)).ravel())
+        similarity = (tf_idf @ tf_idf.T).toarray()
+        similarity = similarity / norms[:, np.newaxis] / norms[np.newaxis, :]
+        similarity[(norms == 0), :] = 0.0
+        similarity[:, (norms == 0)] = 0.0
+        adjacency = (similarity > threshold).astype(np.float64)
+        degrees = adjacency.sum(axis=1)
+        degrees[degrees == 0] = 1
+        matrix = sparse.csr_matrix(adjacency / degrees[:, np.newaxis])
+        transposed_matrix = matrix.T.tocsr()
+        p_vector = np.array([1.0 / num_sentences] * num_sentences)
+        lambda_val = 1.0
+        while lambda_val > epsilon:
+            next_p = transposed_matrix @ p_vector
+            next_p /= np.linalg.norm(next_p)
+            lambda_val = np.linalg.norm(next_p - p_vector)
+            p_vector = next_p
+        return p_vector[self.last_in_group]
+
+    def get_edges(self):
+        """ The number of common words between each pair of sentences, and the log lengths. """
+        common = (self.counts @ self.counts.T).toarray()
+        log_lengths = np.log(self.lengths)
+        norm = log_lengths[:, np.newaxis] + log_lengths[np.newaxis, :]
+        return common, norm
+
+    def rate_textrank(self, epsilon=1e-4, damping=0.85):
+        """ TextRank: PageRank with damping on the graph of common words between sentences. """
+        num_sentences = len(self.sentences)
+        common, norm = self.get_edges()
+        weights = np.where(common == 0, 0.0,
+                           np.where(np.isclose(norm, 0.), common, common / norm))
+        weights /= (weights.sum(axis=1)[:, np.newaxis] + 1e-7)
+        transposed_weights = sparse.csr_matrix(weights.T)
+        p_vector = np.array([1.0 / num_sentences] * num_sentences)
+        lambda_val = 1.0
+        while lambda_val > epsilon:
+            next_p = (1. - damping) / num_sentences * p_vector.sum() + \
+                damping * (transposed_weights @ p_vector)
+            lambda_val = np.linalg.norm(next_p - p_vector)
+            p_vector = next_p
+        return p_vector[self.last_in_group]
+
+    def rate_reduction(self):
+        """ Reduction: the sum of the edges to all the other sentences. """
+        common, norm = self.get_edges()
+        edges = np.where((common == 0) | (norm == 0.0), 0.0, common / norm)
+        np.fill_diagonal(edges, 0.0)
+        ratings = edges.sum(axis=1)
+        return self.by_sentence(np.bincount(self.groups, weights=ratings,
+                                            minlength=self.num_groups))
+
+    def get_frequencies(self):
+        """ The frequency of each term in the sentences of the document. """
+        term_counts = np.asarray(self.counts.sum(axis=0)).ravel()
+        total = term_counts.sum()
+        return term_counts / total if total > 0 else term_counts
 
-def find_relevant_quote(book_id, chapter, num_sentences=1, technique='luhn'):
+    def rate_sumbasic(self):
+        """ SumBasic: greedily choose sentences, squaring the probability of the words chosen. """
+        word_freq = self.get_frequencies()
+        remaining = np.ones(len(self.sentences), dtype=bool)
+        group_ratings = dict()
+        counts = self.counts
+        for iteration in range(len(self.sentences)):
+            averages = np.where(self.lengths > 0, (counts @ word_freq) / self.lengths, 0.0)
+            averages[~remaining] = -np.inf
+            best = int(np.argmax(averages))
+            remaining[best] = False
+            group_ratings[self.groups[best]] = -len(group_ratings)
+            # update probabilities, once for each time the word is in the sentence
+            for term in self.sentence_terms[best]:
+                word_freq[term] *= word_freq[term]
+        return self.by_sentence([group_ratings[group] for group in range(self.num_groups)])
+
+    def rate_kl(self):
+        """ KL: greedily choose the sentence that makes the summary closest to the document. """
+        doc_freq = self.get_frequencies()
+        in_doc = doc_freq > 0
+        log_freq = np.zeros(len(doc_freq))
+        log_freq[in_doc] = np.log(doc_freq[in_doc])
+        counts = self.counts
+        rows = np.repeat(np.arange(len(self.sentences)), np.diff(counts.indptr))
+        terms = counts.indices
+        log_counts = np.log(counts.data)
+        term_freq = doc_freq[terms]
+        summary_counts = np.zeros(len(doc_freq))
+        summary_length = 0
+        remaining = np.ones(len(self.sentences), dtype=bool)
+        group_ratings = dict()
+        for iteration in range(len(self.sentences)):
+            # the kl divergence of the document from the sentence joined with the summary
+            in_summary = (summary_counts > 0) & in_doc
+            log_summary = np.zeros(len(doc_freq))
+            log_summary[in_summary] = np.log(summary_counts[in_summary])
+            summary_kl = np.sum(doc_freq[in_summary] * (log_freq[in_summary] - log_summary[in_summary]))
+            summary_freq = np.sum(doc_freq[in_summary])
+            entry_in_summary = in_summary[terms]
+            contributions = np.where(
+                entry_in_summary,
+                -term_freq * (np.log(counts.data + summary_counts[terms]) - log_summary[terms]),
+                term_freq * (log_freq[terms] - log_counts))
+            entry_freq = np.where(entry_in_summary, 0.0, term_freq)
+            totals = self.lengths + summary_length
+            kls = summary_kl + np.bincount(rows, weights=contributions, minlength=len(totals)) + \
+                np.log(totals) * (summary_freq + np.bincount(rows, weights=entry_freq,
+                                                             minlength=len(totals)))
+            kls[totals == 0] = 0.0
+            kls[~remaining] = np.inf
+            best = int(np.argmin(kls))
+            remaining[best] = False
+            group_ratings[self.groups[best]] = -1 * len(group_ratings)
+            summary_counts += np.bincount(self.raw_terms[best], minlength=len(doc_freq))
+            summary_length += self.raw_lengths[best]
+        return self.by_sentence([group_ratings[group] for group in range(self.num_groups)])
+
+    def rate_random(self):
+        """ Random: a random order of the sentences. """
+        ratings = list(range(len(self.sentences)))
+        random.shuffle(ratings)
+        return np.array(ratings, dtype=np.float64)[self.last_in_group]
+
+
+def get_techniques(technique):
+    """
+    Get the extractive summarization techniques chosen.
+
+    Parameters:
+    technique: the name of a technique, a comma separated list of names, or all
+
+    Returns:
+    list: the names of the techniques
+    """
+    if technique == 'all':
+        return list(TECHNIQUES)
+    names = [name.strip() for name in technique.split(',') if len(name.strip()) > 0]
+    if len(names) == 0:
+        return [technique]
+    return names
+
+
+def summarize_with_sumy(document, num_sentences, technique):
+    """
+    Create an extractive summary with the sumy summarizer, as SentenceTermMatrix.summarize does.
+    This is slower on long chapters and is kept to check the results.
+
+    Parameters:
+    document: the sumy document for the chapter
+    num_sentences: how many sentences to extract
+    technique: the name of the extractive summarization technique
+
+    Returns:
+    sentences: the extracted sentences
+    """
+    summarizer = SUMY_SUMMARIZERS.get(technique, LuhnSummarizer)()
+    return summarizer(document, num_sentences)
+
+
+def find_relevant_quote(book_id, chapter, num_sentences=1, technique='luhn', document=None):
     """
     Create an extractive summary for a chapter of the book.
 
@@ -24,27 +353,17 @@ def find_relevant_quote(book_id, chapter, num_sentences=1, technique='luhn'):
     book_id: (str) the book identifier
     chapter: is the chapter number to summarize
     num_sentences: how many sentences to extract
+    technique: the name of the extractive summarization technique
+    document: the SentenceTermMatrix or the sumy document for the chapter,
+    parsed from the chapter file if not given
 
     Returns:
     sentences: the extracted sentences
     """
-    chapter_filename = get_data_filename(book_id, 'book_chapters', chapter)
-    parser = PlaintextParser.from_file(chapter_filename, Tokenizer("english"))
-    if technique=='lsa':
-        summarizer = LsaSummarizer()
-    elif technique=='lexrank':
-        summarizer = LexRankSummarizer()
-    elif technique=='textrank':
-        summarizer = TextRankSummarizer()
-    elif technique=='kl':
-        summarizer = KLSummarizer()
-    elif technique=='random':
-        summarizer = RandomSummarizer()
-    elif technique=='reduction':
-        summarizer = ReductionSummarizer()
-    elif technique=='sumbasic':
-        summarizer = SumBasicSummarizer()
-    else:
-        summarizer = LuhnSummarizer()
-    summary = summarizer(parser.document, num_sentences)
-    return summary
+    if document is None:
+        chapter_filename = get_data_filename(book_id, 'book_chapters', chapter)
+        document = PlaintextParser.from_file(chapter_filename, Tokenizer("english")).document
+    if not isinstance(document, SentenceTermMatrix):
+        document = SentenceTermMatrix(document)
+    return document.summarize(technique, num_sentences)
+
@@ -0,0 +1,173 @@
+"""
+This file has the process-wide registry for the spaCy models.
+Each model is loaded once per process, the first time it is requested.
+"""
+
+from spacy import load
+from importlib import metadata
+from threading import Lock
+from profiler import span
+import time
+
+DEFAULT_MODEL = 'en_core_web_lg'
+FALLBACK_MODEL = 'en_core_web_sm'
+# a spaCy pipeline with only the tokenizer, which does not need a model to be installed
+BLANK_MODEL = 'blank:en'
+
+_models = dict()
+_load_stats = dict()
+_lock = Lock()
+
+
+def _registry_key(model_name, disable, enable=(), fallback=FALLBACK_MODEL):
+    """
+    Get the registry key for a model name, the pipes that are disabled or enabled,
+    and the fallback model, as a request without a fallback must not get the fallback model.
+    """
+    return (model_name, tuple(sorted(disable)), tuple(sorted(enable)), fallback)
+
+
+def _find_loaded_model(key):
+    """
+    Find a model in the registry that was loaded as the model of key itself,
+    without a fallback, for a request with another fallback model.
+
+    Parameters:
+    key: the registry key of the request
+
+    Returns:
+    the loaded spaCy language model, or None if there is none
+    """
+    for other_key, nlp in _models.items():
+        if (other_key[:3] == key[:3]) and (_load_stats[other_key]['loaded_model'] == key[0]):
+            return nlp
+    return None
+
+
+def load_nlp(model_name=DEFAULT_MODEL, disable=(), fallback=FALLBACK_MODEL, enable=()):
+    """
+    Get a loaded spaCy model from the registry, loading it on first use.
+
+    If the model cannot be loaded and a fallback model is given, the fallback
+    model is loaded instead and is returned for later requests of the same model with
+    the same fallback. A request without a fallback never gets a fallback model.
+
+    Parameters:
+    model_name: the name of the spaCy model to load
+    disable: the names of the pipeline components to disable
+    fallback: the name of the model to load when model_name is not available,
+    or None to raise an error instead
+    enable: the names of the pipeline components that are disabled by default in the
+    model to enable, such as senter, components the model does not have are added,
+    such as sentencizer
+
+    Returns:
+    the loaded spaCy language model
+    """
+    key = _registry_key(model_name, disable, enable, fallback)
+    if key in _models:
+        _load_stats[key]['requests'] += 1
+        return _models[key]
+    with _lock:
+        if key not in _models:
+            start_time = time.time()
+            loaded_name = model_name
+            # the same model may already be loaded for a request with another fallback
+            nlp = _find_loaded_model(key)
+            if nlp is None:
+                with span('load spacy model'):
+                    try:
+                        nlp = load(model_name, disable=list(disable))
+                    except OSError:
+                        if fallback is None:
+                            raise
+                        loaded_name = fallback
+                        nlp = load(fallback, disable=list(disable))
+                    for name in enable:
+                        if name in nlp.component_names:
+                            nlp.enable_pipe(name)
+                        else:
+                            nlp.add_pipe(name)
+            _models[key] = nlp
+            _load_stats[key] = {'model': model_name,
+                                'loaded_model': loaded_name,
+                                'disable': list(key[1]),
+                                'enable': list(key[2]),
+                                'load_time': time.time() - start_time,
+                                'requests': 0}
+        _load_stats[key]['requests'] += 1
+        return _models[key]
+
+
+def get_model_version(model_name=DEFAULT_MODEL, fallback=FALLBACK_MODEL):
+    """
+    Get the name and version of the model that load_nlp uses, without loading it.
+
+    Parameters:
+    model_name: the name of the spaCy model
+    fallback: the name of the model used when model_name is not available
+
+    Returns:
+    str: the model name and version, or the model name if it is not an installed package
+    """
+    for name in [model_name, fallback]:
+        if name is None:
+            continue
+        try:
+            return name + '-' + metadata.version(name)
+        except metadata.PackageNotFoundError:
+            continue
+    return model_name
+
+
+def get_other_pipes(nlp, pipes):
+    """
+    Get the names of the enabled pipeline components that are not in pipes, to disable
+    for one call of the model, so that the model can be shared by all the features.
+
+    Parameters:
+    nlp: the loaded spaCy language model
+    pipes: the names of the pipeline components to keep
+
+    Returns:
+    list: the names of the other enabled components
+    """
+    return [name for name in nlp.pipe_names if name not in pipes]
+
+
+def parse_with_pipes(nlp, text, pipes):
+    """
+    Parse a text with only some of the components of a model, which can include
+    components that are disabled by default, such as senter. The model is not changed,
+    so it can be used by other threads at the same time.
+
+    Parameters:
+    nlp: the loaded spaCy language model
+    text: the text to parse
+    pipes: the names of the pipeline components to run, in order
+
+    Returns:
+    the spaCy doc
+    """
+    doc = nlp.make_doc(text)
+    for name in pipes:
+        doc = nlp.get_pipe(name)(doc)
+    return doc
+
+
+def get_model_load_stats():
+    """
+    Get the load time metrics for the models in the registry.
+
+    Returns:
+    list: one dict per loaded model, with the requested and loaded model name,
+    the disabled and enabled pipes, the load time in seconds and the number of requests
+    """
+    return [dict(stats) for stats in _load_stats.values()]
+
+
+def clear_models():
+    """ Remove all the models from the registry so that they are loaded again on next use. """
+    with _lock:
+        _models.clear()
+        _load_stats.clear()
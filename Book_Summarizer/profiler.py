@@ -0,0 +1,207 @@
+"""
+This file has the tracing for the book summarizer.
+Spans time the stages of a summary, such as the features of each chapter, the model
+loads and the file reading and writing, and are combined into a profile of the book.
+When no spans are being collected a span does nothing, so tracing can be left in place.
+"""
+
+from contextlib import contextmanager
+import csv
+import json
+import sys
+import threading
+import time
+
+# the spans are collected for each thread, as the summary service runs books in threads
+_state = threading.local()
+
+
+class Span:
+    """
+    Times a stage, as a context manager.
+    The time of the spans started inside a span is kept, so that the time spent
+    in the stage itself (self_time) is known.
+    """
+
+    def __init__(self, name):
+        """
+        Parameters:
+        name: the name of the stage
+        """
+        self.name = name
+        self.start = 0.0
+        self.child_time = 0.0
+
+    def __enter__(self):
+        _state.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        _state.stack.pop()
+        if len(_state.stack) > 0:
+            _state.stack[-1].child_time += duration
+        _state.spans.append({'name': self.name, 'chapter': _state.chapter,
+                             'time': duration, 'self_time': duration - self.child_time})
+        return False
+
+
+class NoSpan:
+    """ A span that does nothing, used when the spans are not collected. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name):
+    """
+    Get a span for a stage, which times the stage if spans are being collected in
+    this thread.
+
+    Parameters:
+    name: the name of the stage
+
+    Returns:
+    the span, to use in a with statement
+    """
+    if getattr(_state, 'spans', None) is None:
+        return NO_SPAN
+    return Span(name)
+
+
+@contextmanager
+def collect_spans(enabled=True, chapter=None):
+    """
+    Collect the spans in this thread into a new list, until the with statement ends.
+
+    Parameters:
+    enabled: if False, no spans are collected and the list is None
+    chapter: the chapter number that the spans are for, or None for the whole book
+
+    Returns:
+    list: the spans, each a dict with the name, chapter, time and self_time
+    """
+    if not enabled:
+        yield None
+        return
+    previous = (getattr(_state, 'spans', None), getattr(_state, 'stack', None),
+                getattr(_state, 'chapter', None))
+    spans = []
+    _state.spans = spans
+    _state.stack = []
+    _state.chapter = chapter
+    try:
+        yield spans
+    finally:
+        _state.spans, _state.stack, _state.chapter = previous
+
+
+def trace_iter(iterable, name):
+    """
+    Time getting each item of an iterator, such as the chapters read from a book.
+
+    Parameters:
+    iterable: the items
+    name: the name of the stage
+
+    Returns:
+    iterator: the same items
+    """
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def get_peak_memory():
+    """
+    Get the peak resident memory of this process and of its finished worker processes.
+    The peak is the largest since the process started, not since the book started,
+    so when several books are summarized in one process it includes the earlier books.
+
+    Returns:
+    float: the peak memory of this process in MB, or None if it is not available
+    float: the largest peak memory of a worker process in MB, or None if it is not available
+    """
+    try:
+        # resource is not available on Windows
+        import resource
+    except ImportError:
+        return None, None
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def create_profile(book_id, spans, total_time):
+    """
+    Create the profile of a book from its spans.
+
+    Parameters:
+    book_id: (str) the book identifier
+    spans: the spans of the book and of its chapters
+    total_time: the time taken to summarize the book in seconds
+
+    Returns:
+    dict: the total time and the peak memory of the process so far, the totals for each stage, and the time of
+    each stage for the whole book and for each chapter
+    """
+    stages = dict()
+    book = dict()
+    chapters = dict()
+    for record in spans:
+        stage = stages.setdefault(record['name'], {'name': record['name'], 'count': 0,
+                                                   'time': 0.0, 'self_time': 0.0})
+        stage['count'] += 1
+        stage['time'] += record['time']
+        stage['self_time'] += record['self_time']
+        if record['chapter'] is None:
+            times = book
+        else:
+            times = chapters.setdefault(record['chapter'], dict())
+        times[record['name']] = times.get(record['name'], 0.0) + record['self_time']
+    peak_memory, peak_worker_memory = get_peak_memory()
+    return {'book_id': book_id,
+            'time': total_time,
+            'process_peak_memory_mb': peak_memory,
+            'process_peak_worker_memory_mb': peak_worker_memory,
+            'stages': sorted(stages.values(), key=lambda stage: -stage['self_time']),
+            'book': book,
+            'chapters': [{'chapter': chapter, 'time': sum(times.values()), 'stages': times}
+                         for chapter, times in sorted(chapters.items())]}
+
+
+def save_profile(profile, json_filename, csv_filename):
+    """
+    Save the profile of a book as json, and the time of each stage for the whole book
+    and for each chapter as csv.
+
+    Parameters:
+    profile: the profile from create_profile
+    json_filename: the filename of the json file
+    csv_filename: the filename of the csv file
+    """
+    with open(json_filename, 'w') as json_file:
+        json.dump(profile, json_file, indent=1)
+    names = [stage['name'] for stage in profile['stages']]
+    rows = [['book', sum(profile['book'].values())] +
+            [profile['book'].get(name, 0.0) for name in names]]
+    for chapter in profile['chapters']:
+        rows.append([chapter['chapter'], chapter['time']] +
+                    [chapter['stages'].get(name, 0.0) for name in names])
+    with open(csv_filename, 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['chapter', 'time'] + names)
+        writer.writerows(rows)
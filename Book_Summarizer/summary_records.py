@@ -0,0 +1,214 @@
+"""
+This file has the structured output of the book summarizer.
+The summary of a book is saved as JSON Lines, one record for each line, written as the
+chapters are summarized, and the text summary and entities csv file are created from
+the records.
+"""
+
+from entity_extraction import create_sentence, save_sorted_entities
+import json
+
+
+class SummaryRecordWriter:
+    """
+    Writes the records of a summary to a JSON Lines file, as a context manager.
+    The file is opened once and each record is flushed when it is written, so the
+    chapters summarized so far can be read while the book is being summarized.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters:
+        filename: the filename of the JSON Lines file
+        """
+        self.filename = filename
+        self.records = []
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.filename, 'w')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+        return False
+
+    def write(self, record):
+        """
+        Write a record to the file, and keep it to create the text summary.
+
+        Parameters:
+        record: the record, a dict that can be saved as json
+        """
+        self.records.append(record)
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+
+def create_book_record(book_id, book_characters=None, book_entities=None):
+    """
+    Create the record for the book, the first record of the summary.
+
+    Parameters:
+    book_id: (str) the book identifier
+    book_characters: the characters found in the whole book, or None without -en
+    book_entities: the key words found in the whole book, or None without -en
+
+    Returns:
+    dict: the record
+    """
+    return {'type': 'book', 'book_id': book_id,
+            'characters': book_characters, 'entities': book_entities}
+
+
+def create_chapter_record(chapter):
+    """
+    Create the record for a chapter, without the abstractive summaries.
+
+    Parameters:
+    chapter: (int) the chapter number
+
+    Returns:
+    dict: the record, with the first lines (first_lines), the characters and key words
+    (characters, entities) and the quotes of each extractive technique (quotes), which
+    are None when the feature is not in the summary, and the time taken (time)
+    """
+    return {'type': 'chapter', 'chapter': chapter, 'first_lines': None,
+            'characters': None, 'entities': None, 'quotes': None, 'time': 0.0}
+
+
+def create_abstractive_record(chapter, abstr_extr, abstr_abstr):
+    """
+    Create the record for the abstractive summaries of a chapter, which are created for
+    all the chapters together after the chapter records are written.
+
+    Parameters:
+    chapter: (int) the chapter number
+    abstr_extr: the lines of the abstractive summary from an extractive summary, or None
+    abstr_abstr: the lines of the abstractive summary from an abstractive summary, or None
+
+    Returns:
+    dict: the record
+    """
+    return {'type': 'abstractive', 'chapter': chapter,
+            'abstr_extr': abstr_extr, 'abstr_abstr': abstr_abstr}
+
+
+def load_records(filename):
+    """
+    Load the records of a summary, including a summary that is still being written.
+
+    Parameters:
+    filename: the filename of the JSON Lines file
+
+    Returns:
+    list: the records
+    """
+    records = []
+    with open(filename, 'r') as records_file:
+        for line in records_file:
+            # the last line of a summary being written may not be complete yet
+            if line.endswith('\n'):
+                records.append(json.loads(line))
+    return records
+
+
+def create_entity_lines(chapter_characters, chapter_entities):
+    """
+    Create the sentences for the characters and key words of a chapter.
+
+    Parameters:
+    chapter_characters: characters found in the chapter
+    chapter_entities: key words found in the chapter
+
+    Returns:
+    str: the lines of the chapter summary about the entities
+    """
+    lines = ''
+    line = create_sentence(
+        chapter_characters, about_book=False, about_characters=True)
+    if (len(line) > 0):
+        lines += line + '\n'
+    line = create_sentence(
+        chapter_entities, about_book=False, about_characters=False)
+    if (len(line) > 0):
+        lines += line + '\n'
+    return lines
+
+
+def render_chapter(record, abstractive_record=None):
+    """
+    Create the text summary of a chapter.
+
+    Parameters:
+    record: the chapter record
+    abstractive_record: the abstractive record of the chapter, if there is one
+
+    Returns:
+    str: the summary of the chapter
+    """
+    summary = ["Chapter " + str(record['chapter']) + '\n']
+    if record['first_lines'] is not None:
+        summary.append("Starting:\n")
+        summary.append(record['first_lines'])
+    if record['characters'] is not None:
+        summary.append(create_entity_lines(record['characters'], record['entities']))
+    if record['quotes'] is not None:
+        for technique, quote in record['quotes']:
+            # label the quotes with the technique when there are several
+            label = ''
+            if len(record['quotes']) > 1:
+                label = ' (' + technique + ')'
+            if len(quote) == 1:
+                summary.append('Quote' + label + ': ')
+            else:
+                summary.append('Quotes' + label + ':\n')
+            for q in quote:
+                summary.append('"' + q + '"\n')
+    if abstractive_record is not None:
+        for feature in ['abstr_extr', 'abstr_abstr']:
+            if abstractive_record[feature] is not None:
+                summary.extend(abstractive_record[feature])
+    summary.append('\n')
+    return ''.join(summary)
+
+
+def render_summary(records):
+    """
+    Create the text summary of a book from its records.
+
+    Parameters:
+    records: the records of the summary
+
+    Returns:
+    str: the summary of the book
+    """
+    summary = []
+    abstractive_records = {record['chapter']: record for record in records
+                           if record['type'] == 'abstractive'}
+    for record in records:
+        if record['type'] == 'book' and record['characters'] is not None:
+            summary.append(create_sentence(
+                record['characters'], about_book=True, about_characters=True) + '\n')
+            summary.append(create_sentence(
+                record['entities'], about_book=True, about_characters=False) + '\n')
+            summary.append('\n')
+        elif record['type'] == 'chapter':
+            summary.append(render_chapter(
+                record, abstractive_records.get(record['chapter'])))
+    return ''.join(summary)
+
+
+def save_entities(book_id, records):
+    """
+    Save the entities csv file of a book from the records of its summary with -en.
+
+    Parameters:
+    book_id: (str) the book identifier
+    records: the records of the summary
+    """
+    book_record = next(record for record in records if record['type'] == 'book')
+    save_sorted_entities(
+        book_id, book_record['characters'], book_record['entities'],
+        [(record['characters'], record['entities'])
+         for record in records if record['type'] == 'chapter'])
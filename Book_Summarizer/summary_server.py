@@ -0,0 +1,308 @@
+"""
+This file has the summary service, a local HTTP server that keeps the models loaded
+between summaries.
+Each request gives the text of a book, or the identifier of a book in data/raw_books,
+and the same summary features as the book summarizer command line.
+"""
+
+from book_summarizer import create_parser, check_args, summarize_book, is_book_complete
+from data import stream_book, get_data_filename, get_results_filename, get_entities_filename
+from artifact_cache import text_digest
+from nlp_models import load_nlp, get_model_load_stats
+from abstractive_summarizer import configure_abstractive_summarizer, get_abstractive_summarizer
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from os import makedirs
+from os.path import exists, isfile
+from threading import Thread, Event, Lock
+import argparse
+import json
+import queue
+import time
+import traceback
+
+# the options that are fixed when the server starts, as the models are shared by all requests
+SERVER_OPTIONS = ['device', 'threads', 'interopThreads', 'quantize']
+
+
+class SummaryJob:
+    """ A book to summarize, and the result once the summary is created. """
+
+    def __init__(self, book_id, args, encoding='latin-1'):
+        """
+        Parameters:
+        book_id: (str) the book identifier
+        args: the summary features, parsed from the flags of the request
+        encoding: the encoding of the raw book file, utf-8 for the text of a request
+        """
+        self.book_id = book_id
+        self.args = args
+        self.encoding = encoding
+        self.done = Event()
+        self.result = None
+        self.error = ''
+
+
+class SummaryService:
+    """
+    Summarizes books in worker threads, taking jobs from a bounded queue.
+
+    The spaCy models and the abstractive summarizer are loaded once, when the service
+    starts, and are shared by all the jobs. Jobs for the same book run one at a time,
+    as they write the same summary files.
+    """
+
+    def __init__(self, server_args):
+        """
+        Parameters:
+        server_args: the command line arguments of the server
+        """
+        self.server_args = server_args
+        self.jobs = queue.Queue(maxsize=server_args.queueSize)
+        self.book_locks = dict()
+        self.lock = Lock()
+        self.stats = {'queued': 0, 'running': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        self.workers = [Thread(target=self.run_jobs, daemon=True)
+                        for _ in range(server_args.jobWorkers)]
+
+    def start(self):
+        """ Load the models and start the worker threads. """
+        start_time = time.time()
+        # one model is used by the chapter analysis, the book entities and the segments
+        load_nlp()
+        configure_abstractive_summarizer(
+            self.server_args.device, self.server_args.threads,
+            self.server_args.interopThreads, self.server_args.quantize)
+        if not self.server_args.noAbstractive:
+            get_abstractive_summarizer()
+        print("Models loaded in {:.1f}s".format(time.time() - start_time))
+        for worker in self.workers:
+            worker.start()
+
+    def create_job(self, request):
+        """
+        Create the job for a request, saving the text of the book in data/raw_books.
+
+        Parameters:
+        request: the decoded JSON request, with the book text or book_id, and the flags
+
+        Returns:
+        SummaryJob: the job
+        """
+        flags = request.get('flags', [])
+        if not isinstance(flags, list) or not all(isinstance(flag, str) for flag in flags):
+            raise ValueError("flags should be a list of command line arguments")
+        try:
+            args = create_parser().parse_args(flags)
+        except SystemExit:
+            raise ValueError("flags are not valid: " + ' '.join(flags))
+        error = check_args(args)
+        if len(error) > 0:
+            raise ValueError(error)
+        for option in SERVER_OPTIONS:
+            setattr(args, option, getattr(self.server_args, option))
+        # the chapters are summarized in the worker thread, where the models are loaded
+        args.workers = 1
+        encoding = 'latin-1'
+        if 'text' in request:
+            if not isinstance(request['text'], str) or len(request['text'].strip()) == 0:
+                raise ValueError("text should be the text of the book")
+            # the same text is the same book, so its summaries and cache are reused
+            book_id = 'text-' + text_digest(request['text'])[:16]
+            if not exists('../data/raw_books'):
+                makedirs('../data/raw_books')
+            with self.get_book_lock(book_id):
+                if not isfile(get_data_filename(book_id, 'raw_books')):
+                    with open(get_data_filename(book_id, 'raw_books'), 'wb') as book:
+                        book.write(request['text'].encode('utf-8'))
+            encoding = 'utf-8'
+        elif 'book_id' in request:
+            book_id = str(request['book_id'])
+            if ('/' in book_id) or not isfile(get_data_filename(book_id, 'raw_books')):
+                raise ValueError("book " + book_id + " is not in data/raw_books")
+        else:
+            raise ValueError("give the text of the book or a book_id")
+        return SummaryJob(book_id, args, encoding)
+
+    def submit(self, job):
+        """
+        Add a job to the queue.
+
+        Parameters:
+        job: the SummaryJob
+
+        Returns:
+        bool: False if the queue is full and the job was not added
+        """
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            self.update_stats('rejected', 1)
+            return False
+        self.update_stats('queued', 1)
+        return True
+
+    def get_book_lock(self, book_id):
+        """ Get the lock for the files of a book. """
+        with self.lock:
+            if book_id not in self.book_locks:
+                self.book_locks[book_id] = Lock()
+            return self.book_locks[book_id]
+
+    def update_stats(self, name, change):
+        """ Change one of the job counts. """
+        with self.lock:
+            self.stats[name] += change
+
+    def get_status(self):
+        """
+        Get the status of the service.
+
+        Returns:
+        dict: the job counts and the models loaded
+        """
+        with self.lock:
+            status = dict(self.stats)
+        status['queue_size'] = self.server_args.queueSize
+        status['models'] = get_model_load_stats()
+        return status
+
+    def run_jobs(self):
+        """ Run the jobs from the queue, for each worker thread. """
+        while True:
+            job = self.jobs.get()
+            self.update_stats('queued', -1)
+            self.update_stats('running', 1)
+            try:
+                job.result = self.run_job(job)
+                self.update_stats('completed', 1)
+            except Exception:
+                job.error = traceback.format_exc()
+                self.update_stats('failed', 1)
+            self.update_stats('running', -1)
+            job.done.set()
+
+    def run_job(self, job):
+        """
+        Summarize the book of a job.
+
+        Parameters:
+        job: the SummaryJob
+
+        Returns:
+        dict: the book identifier, the number of chapters summarized, the summary text,
+        the entities csv text if -en is used, and the time taken in seconds
+        """
+        start_time = time.time()
+        args = job.args
+        with self.get_book_lock(job.book_id):
+            # a summary from an earlier request is reused if all its outputs exist
+            if not is_book_complete(job.book_id, args):
+                args.w = True
+            num_chapters = summarize_book(
+                job.book_id, stream_book(job.book_id, args.exportChapters, job.encoding), args)
+            with open(get_results_filename(job.book_id, args), 'r') as summary_file:
+                summary = summary_file.read()
+            entities = None
+            if args.en:
+                with open(get_entities_filename(job.book_id), 'r') as entities_file:
+                    entities = entities_file.read()
+        return {'book_id': job.book_id, 'chapters': num_chapters, 'summary': summary,
+                'entities': entities, 'time': time.time() - start_time}
+
+
+class SummaryRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests to the summary service.
+
+    POST /summarize with a JSON object with the text of the book (text) or the
+    identifier of a book in data/raw_books (book_id), and the command line flags for
+    the summary features (flags), such as ["-fl", "-en", "-ex", "2"].
+    GET /status returns the job counts and the models loaded.
+    """
+
+    service = None
+
+    def send_json(self, code, data):
+        """ Send a response with a JSON body. """
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.service.get_status())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/summarize':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError("the request should be a JSON object")
+            job = self.service.create_job(request)
+        except ValueError as error:
+            # json.JSONDecodeError is also a ValueError
+            self.send_json(400, {'error': str(error)})
+            return
+        if not self.service.submit(job):
+            self.send_json(503, {'error': 'the queue is full, try again later'})
+            return
+        job.done.wait()
+        if job.error:
+            self.send_json(500, {'error': job.error})
+        else:
+            self.send_json(200, job.result)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the book summarizer as a local HTTP service with the models loaded')
+    parser.add_argument(
+        "-host", help="the address to listen on (default is 127.0.0.1)", default='127.0.0.1')
+    parser.add_argument(
+        "-port", help="the port to listen on (default is 8000)", type=int, default=8000)
+    parser.add_argument(
+        "-jobWorkers", help="the number of books summarized at the same time " \
+        "(default is 1)", type=int, default=1)
+    parser.add_argument(
+        "-queueSize", help="the maximum number of books waiting to be summarized, " \
+        "more requests are rejected (default is 8)", type=int, default=8)
+    parser.add_argument(
+        "-noAbstractive", help="do not load the abstractive summarizer when the " \
+        "service starts", action="store_true")
+    parser.add_argument(
+        "-device", help="the device for the abstractive summarizer: cpu, cuda, or auto " \
+        "to use a GPU only if one is available (default is auto)", default='auto')
+    parser.add_argument(
+        "-threads", help="the number of CPU threads for the abstractive summarizer " \
+        "(default is the torch default)", type=int, default=0)
+    parser.add_argument(
+        "-interopThreads", help="the number of CPU threads between operations for the " \
+        "abstractive summarizer (default is the torch default)", type=int, default=0)
+    parser.add_argument(
+        "-quantize", help="use an int8 quantized abstractive summarizer model on the CPU",
+        action="store_true")
+    args = parser.parse_args()
+    if not exists('../results'):
+        makedirs('../results')
+    service = SummaryService(args)
+    service.start()
+    SummaryRequestHandler.service = service
+    server = ThreadingHTTPServer((args.host, args.port), SummaryRequestHandler)
+    print("Summary service on http://{}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+This file has the vectors of a summary used to compare it with the ground truth summary,
+the spaCy doc vector and the term frequencies, and the scores of the analysis.
+It does not import the abstractive summarizer, so the summaries can be compared
+without torch and LeafNATS.
+"""
+
+from artifact_cache import ArtifactCache, text_digest
+from nlp_models import load_nlp, get_model_version
+from collections import Counter
+from os.path import isfile
+from sumy.parsers.plaintext import PlaintextParser
+from sumy.nlp.tokenizers import Tokenizer
+from sumy.models import TfDocumentModel
+from sumy.evaluation import cosine_similarity
+import numpy as np
+
+
+def load_summary(filename, cache=None):
+    """
+    Load the summary for analysis.
+    The spaCy doc vector and the term frequencies of the summary are saved in the cache,
+    keyed by the hash of the summary text, so a summary that has not changed, such as
+    the ground truth summary, is not parsed again.
+
+    Parameters:
+    filename: the filename of the summary text file
+    cache: the ArtifactCache for the vectors, or None to not cache them
+
+    Returns:
+    dict: the spaCy doc vector (vector), which is None if the spaCy model is not
+    available, and the sumy term frequencies (terms), or None if there is no summary file
+    """
+    if not isfile(filename):
+        return None
+    with open(filename, 'r') as summary_file:
+        summary_text = summary_file.read()
+    if cache is None:
+        cache = ArtifactCache(None)
+    # the vector is only available from the default model, without the fallback model
+    params = {'model': get_model_version(fallback=None)}
+    return cache.get_or_compute(text_digest(summary_text), 'summary_vectors', params,
+                                lambda: create_summary_vectors(summary_text))
+
+
+def create_summary_vectors(summary_text):
+    """
+    Parse a summary to get the vectors used in the analysis.
+
+    Parameters:
+    summary_text: the text of the summary
+
+    Returns:
+    dict: the spaCy doc vector (vector), which is None if the spaCy model is not
+    available, and the sumy term frequencies (terms)
+    """
+    vector = None
+    try:
+        nlp = load_nlp(fallback=None)
+    except:
+        nlp = None
+    if nlp is not None:
+        # the lines are joined as the words of each line are parsed together
+        summary_doc = nlp(' '.join(summary_text.splitlines(True)))
+        vector = [float(value) for value in summary_doc.vector]
+    summary_parser = PlaintextParser(summary_text, Tokenizer("english"))
+    summary_model = TfDocumentModel(
+        str(summary_parser.document.sentences), Tokenizer("en"))
+    terms = {term: summary_model.term_frequency(term) for term in summary_model.terms}
+    return {'vector': vector, 'terms': terms}
+
+
+def score_summary(summary_vectors, new_summary_vectors):
+    """
+    Compare a created summary with the ground truth summary.
+
+    Parameters:
+    summary_vectors: the vectors of the ground truth summary from load_summary
+    new_summary_vectors: the vectors of the created summary from load_summary
+
+    Returns:
+    list: the name and value of each measure, the word embeddings similarity
+    (the cosine of the spaCy doc vectors) and the cosine similarity of the term frequencies
+    """
+    analysis_data = []
+    if summary_vectors is None or new_summary_vectors is None:
+        return analysis_data
+    if summary_vectors['vector'] is not None and new_summary_vectors['vector'] is not None:
+        vector = np.array(summary_vectors['vector'], dtype=np.float32)
+        new_vector = np.array(new_summary_vectors['vector'], dtype=np.float32)
+        norm = np.linalg.norm(vector) * np.linalg.norm(new_vector)
+        analysis_data.append(['word embeddings similarity',
+                              float(np.dot(vector, new_vector) / norm) if norm > 0 else 0.0])
+    analysis_data.append(['cosine similarity', cosine_similarity(
+        TfDocumentModel(list(Counter(summary_vectors['terms']).elements())),
+        TfDocumentModel(list(Counter(new_summary_vectors['terms']).elements())))])
+    return analysis_data